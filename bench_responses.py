@@ -0,0 +1,253 @@
+# bench_responses.py
+"""Response-write throughput benchmark.
+
+Simulates N participants pressing "Submit Ratings" at the same moment and
+measures how the response pipeline holds up against an in-process stand-in
+for the Google Sheets API (configurable latency, per-minute quota and random
+429s). Nothing touches the network.
+
+    python bench_responses.py --sessions 50 --submits 4 --latency 0.3 --quota 300
+    python bench_responses.py --mode direct      # pre-queue behaviour, one append_row per answer
+    python bench_responses.py --backend sqlite   # local SQLite engine instead of Sheets
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+
+import gspread
+import requests
+
+from question_plans import PART1_QUESTION_IDS
+from response_records import StudyPhase, build_response_record
+from response_store import LIKERT_OPTIONS, ResponseWriter, SheetSchema, SheetsClient, create_backend, likert_code_map, queue_responses
+
+LIKERT_CODES = likert_code_map()
+
+
+# --- Fake Sheets API ---
+def make_api_error(code, message):
+    """Builds a gspread APIError the same way gspread does from an HTTP response."""
+    response = requests.Response()
+    response.status_code = code
+    response._content = json.dumps({"error": {"code": code, "message": message, "status": "RESOURCE_EXHAUSTED"}}).encode()
+    return gspread.exceptions.APIError(response)
+
+
+class FakeSheetsServer:
+    """Shared state of one fake spreadsheet: rows, latency model, quota and error injection."""
+
+    def __init__(self, latency=0.3, jitter=0.1, quota_per_minute=300, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.quota_per_minute = quota_per_minute
+        self.error_rate = error_rate
+        self.rows = []
+        self.requests = 0
+        self.errors_429 = 0
+        self._recent = deque() # Timestamps of requests in the last minute
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def call(self):
+        """Simulates one HTTP round-trip; raises a 429 APIError when over quota or on an injected error."""
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            self.requests += 1
+            over_quota = self.quota_per_minute and len(self._recent) >= self.quota_per_minute
+            injected = self._random.random() < self.error_rate
+            delay = max(0.0, self._random.gauss(self.latency, self.jitter))
+            if not over_quota:
+                self._recent.append(now)
+        time.sleep(delay)
+        if over_quota or injected:
+            with self._lock:
+                self.errors_429 += 1
+            raise make_api_error(429, "Quota exceeded for quota metric 'Write requests'")
+
+
+class FakeSpreadsheet:
+    def __init__(self, server):
+        self.server = server
+
+    def fetch_sheet_metadata(self):
+        self.server.call()
+        return {}
+
+
+class FakeWorksheet:
+    """Implements the subset of gspread.Worksheet used by the app, backed by a FakeSheetsServer."""
+
+    def __init__(self, server):
+        self.server = server
+        self.spreadsheet = FakeSpreadsheet(server)
+        self.spreadsheet_id = "fake-spreadsheet"
+        self.id = 0
+
+    def range(self, name):
+        self.server.call()
+        value = self.server.rows[0][0] if self.server.rows else ""
+        return [gspread.Cell(1, 1, value)]
+
+    def row_values(self, row):
+        self.server.call()
+        rows = self.server.rows
+        return list(rows[row - 1]) if len(rows) >= row else []
+
+    def update(self, values=None, range_name=None, **kwargs):
+        self.server.call()
+        with self.server._lock:
+            if self.server.rows:
+                self.server.rows[0] = list(values[0])
+            else:
+                self.server.rows.append(list(values[0]))
+
+    def append_row(self, values, **kwargs):
+        self.append_rows([values])
+
+    def append_rows(self, values, **kwargs):
+        self.server.call()
+        with self.server._lock:
+            self.server.rows.extend(list(v) for v in values)
+
+    def get_all_records(self, **kwargs):
+        self.server.call()
+        header, *rows = self.server.rows or [[]]
+        return [dict(zip(header, row)) for row in rows]
+
+
+# --- Submit paths under test ---
+def direct_submit(worksheet, rows):
+    """The pre-queue save_response: a header check and an append_row per answer, synchronously.
+
+    Returns the number of rows that fell back to the local backup file.
+    """
+    fallbacks = 0
+    for row in rows:
+        try:
+            cell_list = worksheet.range('A1:A1')
+            if not cell_list[0].value:
+                worksheet.append_row(list(row.keys()))
+            worksheet.append_row(list(row.values()))
+        except Exception:
+            fallbacks += 1
+    return fallbacks
+
+
+def queued_submit(writer, email, caption_id, answers):
+    """The app's save_responses: one durable batch per submit. Returns the number of rows that fell back."""
+    unlogged = queue_responses(writer, LIKERT_CODES, email, 30, "Other / Prefer not to say", {"video_id": "video_bench"},
+                               {"caption_id": caption_id}, answers, StudyPhase.PART1)
+    return len(unlogged)
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+
+def run_benchmark(args):
+    """Runs one benchmark configuration and returns a dict of results."""
+    server = FakeSheetsServer(args.latency, args.jitter, args.quota, args.error_rate, args.seed)
+    workdir = tempfile.mkdtemp(prefix="bench_responses_")
+    writer = None
+    if args.mode == "queued":
+        client = SheetsClient(lambda: (FakeWorksheet(server), None))
+        path = os.path.join(workdir, f"responses.{args.backend}")
+        backend = create_backend(args.backend, client=client, schema=SheetSchema(), path=path)
+        writer = ResponseWriter(os.path.join(workdir, "wal"), backend, backoff_base=0.5, backoff_max=10.0, idle_poll=0.5)
+    direct_worksheet = FakeWorksheet(server)
+
+    latencies = []
+    fallbacks = 0
+    results_lock = threading.Lock()
+    start_barrier = threading.Barrier(args.sessions)
+
+    def session(n):
+        nonlocal fallbacks
+        email = f"participant{n}@example.com"
+        start_barrier.wait() # Everyone presses "Submit Ratings" together
+        for k in range(args.submits):
+            answers = [(qid, f"{qid} question text", random.choice(LIKERT_OPTIONS[qid])) for qid in PART1_QUESTION_IDS]
+            t0 = time.perf_counter()
+            if writer:
+                fallback_rows = queued_submit(writer, email, f"video_bench_caption{k}", answers)
+            else:
+                records = [build_response_record(email, 30, "Other / Prefer not to say", "video_bench", f"video_bench_caption{k}",
+                                                 choice, StudyPhase.PART1, text, question_id=qid, codes=LIKERT_CODES)
+                           for qid, text, choice in answers]
+                fallback_rows = direct_submit(direct_worksheet, [r.to_row() for r in records])
+            elapsed = time.perf_counter() - t0
+            with results_lock:
+                latencies.append(elapsed)
+                fallbacks += fallback_rows
+            time.sleep(args.think_time)
+
+    t_start = time.perf_counter()
+    threads = [threading.Thread(target=session, args=(n,)) for n in range(args.sessions)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    t_submitted = time.perf_counter()
+    drained = writer.flush(args.drain_timeout) if writer else True
+    t_end = time.perf_counter()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    total_rows = args.sessions * args.submits * len(PART1_QUESTION_IDS)
+    submits = len(latencies)
+    return {
+        "mode": args.mode, "backend": args.backend if writer else "gsheets",
+        "sessions": args.sessions, "submits": submits, "rows": total_rows,
+        "p50_ms": percentile(latencies, 50) * 1000, "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "submit_phase_s": t_submitted - t_start, "end_to_end_s": t_end - t_start,
+        "rows_per_s": total_rows / (t_end - t_start), "fallback_rate": fallbacks / total_rows if total_rows else 0.0,
+        "drained": drained, "api_requests": server.requests, "api_429s": server.errors_429,
+    }
+
+
+def print_report(result):
+    print(f"mode={result['mode']} backend={result['backend']} sessions={result['sessions']} "
+          f"submits={result['submits']} rows={result['rows']}")
+    print(f"  submit latency  p50 {result['p50_ms']:9.1f} ms   p95 {result['p95_ms']:9.1f} ms   p99 {result['p99_ms']:9.1f} ms")
+    print(f"  throughput      {result['rows_per_s']:9.1f} rows/s (end to end {result['end_to_end_s']:.1f}s, "
+          f"submits done after {result['submit_phase_s']:.1f}s, drained={result['drained']})")
+    print(f"  fallback rate   {result['fallback_rate']:9.1%} of rows went to the local backup")
+    print(f"  sheets API      {result['api_requests']} requests, {result['api_429s']} answered 429")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark response writes against a fake Google Sheets API.")
+    parser.add_argument("--mode", choices=["queued", "direct"], default="queued", help="queued = write-ahead log + replayer; direct = one append_row per answer")
+    parser.add_argument("--backend", choices=["gsheets", "sqlite", "jsonl"], default="gsheets")
+    parser.add_argument("--sessions", type=int, default=50, help="simulated participants submitting at once")
+    parser.add_argument("--submits", type=int, default=4, help="Part 1 submits (6 ratings each) per participant")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds between a participant's submits")
+    parser.add_argument("--latency", type=float, default=0.3, help="mean fake Sheets round-trip in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="standard deviation of the round-trip")
+    parser.add_argument("--quota", type=int, default=300, help="requests per minute before 429s (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a random 429")
+    parser.add_argument("--drain-timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    result = run_benchmark(args)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# export_responses.py
+"""Incremental export of collected responses to a partitioned Parquet dataset.
+
+Each run reads only the rows added since the previous run (a high-water mark
+per source is kept in <out>/_sync_state.json), converts them to typed columns
+and writes them under <out>/responses/study_phase=<phase>/date=<YYYY-MM-DD>/.
+The dedup key of every exported row is kept in <out>/_exported_keys.jsonl, so a
+row that reaches several sources (or is re-read after a reset) is exported once.
+
+    python export_responses.py sync --jsonl responses.jsonl --sqlite responses.sqlite3
+    python export_responses.py sync --sheet          # reads .streamlit/secrets.toml
+    python export_responses.py summary --study-phase user_study_part1
+
+Needs pyarrow (pip install -r requirements-media.txt); the study app itself does not.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+import tomllib
+
+import pandas as pd
+
+from response_store import dedup_key, likert_code_map
+
+DEFAULT_OUT_DIR = "exports"
+DEFAULT_SHEET_NAME = "roadtones-streamlit-userstudy-responses"
+QUESTIONS_DATA_PATH = "questions.json"
+SECRETS_PATH = ".streamlit/secrets.toml"
+PARTITION_COLS = ["study_phase", "date"]
+
+
+def require_pyarrow():
+    try:
+        import pyarrow # noqa: F401
+    except ImportError:
+        sys.exit("export_responses.py needs pyarrow: pip install -r requirements-media.txt")
+
+
+# --- High-water marks ---
+def load_state(out_dir):
+    path = os.path.join(out_dir, "_sync_state.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(out_dir, state):
+    path = os.path.join(out_dir, "_sync_state.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# --- Exported keys ---
+def load_exported_keys(out_dir):
+    """dedup_key() of every row exported by earlier runs."""
+    path = os.path.join(out_dir, "_exported_keys.jsonl")
+    if not os.path.exists(path):
+        return set()
+    keys = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                keys.add(tuple(json.loads(line)))
+            except ValueError:
+                continue # A line cut short by an interrupted run
+    return keys
+
+
+def append_exported_keys(out_dir, keys):
+    with open(os.path.join(out_dir, "_exported_keys.jsonl"), "a", encoding="utf-8") as f:
+        f.writelines(json.dumps(list(key)) + "\n" for key in keys)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# --- Sources ---
+def read_jsonl(path, mark):
+    """Rows appended to a JSONL file since byte offset mark['offset']."""
+    offset = mark.get("offset", 0)
+    if not os.path.exists(path):
+        return [], mark
+    if os.path.getsize(path) < offset:
+        offset = 0 # File was truncated or replaced; start over
+    rows = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break # Partially written line; pick it up next run
+            offset += len(line)
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                continue
+    return rows, {"offset": offset}
+
+
+def read_sqlite(path, mark):
+    """Rows inserted into a SQLiteBackend database since id mark['max_id']."""
+    if not os.path.exists(path):
+        return [], mark
+    max_id = mark.get("max_id", 0)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        records = conn.execute("SELECT * FROM responses WHERE id > ? ORDER BY id", (max_id,)).fetchall()
+    finally:
+        conn.close()
+    rows = []
+    for record in records:
+        row = dict(record)
+        max_id = row.pop("id")
+        rows.append({k: v for k, v in row.items() if v is not None})
+    return rows, {"max_id": max_id}
+
+
+def read_sheet(sheet_name, mark):
+    """Sheet rows below data row mark['rows'], fetched with one ranged read."""
+    import gspread
+    with open(SECRETS_PATH, "rb") as f:
+        secrets = tomllib.load(f)
+    client = gspread.service_account_from_dict(secrets["gcp_service_account"])
+    worksheet = client.open(sheet_name).sheet1
+    done = mark.get("rows", 0)
+    header = worksheet.row_values(1)
+    values = worksheet.get(f"A{done + 2}:ZZ", value_render_option="UNFORMATTED_VALUE") if header else []
+    rows = [dict(zip(header, [str(v) for v in row])) for row in values if any(row)]
+    return rows, {"rows": done + len(values)}
+
+
+# --- Typed conversion ---
+def to_typed_frame(rows, codes):
+    """Turns raw string rows into a DataFrame with typed columns and Likert codes."""
+    df = pd.DataFrame(rows)
+    for col in ["email", "age", "gender", "timestamp", "study_phase", "video_id", "sample_id", "question_id", "question_text",
+                "user_choice", "was_correct", "attempts_taken"]:
+        if col not in df:
+            df[col] = None
+    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+    df["date"] = df["timestamp"].dt.strftime("%Y-%m-%d").fillna("unknown")
+    df["study_phase"] = df["study_phase"].fillna("unknown").astype(str)
+    df["age"] = pd.to_numeric(df["age"], errors="coerce").astype("Int16")
+    df["attempts_taken"] = pd.to_numeric(df["attempts_taken"], errors="coerce").astype("Int16")
+    df["was_correct"] = df["was_correct"].map({"True": True, "False": False, True: True, False: False}).astype("boolean")
+    df["user_choice"] = df["user_choice"].astype("string")
+    df["choice_code"] = df["user_choice"].map(codes).astype("Int8")
+    df["gender"] = df["gender"].astype("category")
+    typed = {"timestamp", "date", "study_phase", "age", "attempts_taken", "was_correct", "user_choice", "choice_code", "gender"}
+    for col in df.columns:
+        if col not in typed:
+            df[col] = df[col].astype("string")
+    return df
+
+
+def write_partitions(df, out_dir, run_id):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_to_dataset(table, root_path=os.path.join(out_dir, "responses"), partition_cols=PARTITION_COLS,
+                        basename_template=f"part-{run_id}-{{i}}.parquet")
+
+
+def open_dataset(path):
+    """The exported Parquet dataset, read with a schema unified over all of its files.
+
+    Files from different runs can differ (a column added later, or all-null in one run),
+    so the schema of whichever file comes first is not enough.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    schemas = [dataset.schema] + [fragment.physical_schema for fragment in dataset.get_fragments()]
+    schema = pa.unify_schemas(schemas, promote_options="permissive")
+    return ds.dataset(path, schema=schema, format="parquet", partitioning="hive")
+
+
+# --- Commands ---
+def sync(args):
+    require_pyarrow()
+    os.makedirs(args.out, exist_ok=True)
+    state = load_state(args.out)
+    with open(QUESTIONS_DATA_PATH, "r", encoding="utf-8") as f:
+        codes = likert_code_map(json.load(f))
+
+    sources = [("jsonl:" + os.path.abspath(p), read_jsonl, p) for p in args.jsonl]
+    sources += [("sqlite:" + os.path.abspath(p), read_sqlite, p) for p in args.sqlite]
+    if args.sheet:
+        sources.append(("sheet:" + args.sheet_name, read_sheet, args.sheet_name))
+
+    rows, new_state = [], dict(state)
+    for key, reader, target in sources:
+        source_rows, new_state[key] = reader(target, state.get(key, {}))
+        print(f"{key}: {len(source_rows)} new rows")
+        rows.extend(source_rows)
+
+    seen = load_exported_keys(args.out)
+    unique_rows, new_keys = [], []
+    for row in rows:
+        key = dedup_key(row)
+        if key not in seen:
+            seen.add(key)
+            unique_rows.append(row)
+            new_keys.append(key)
+    if unique_rows:
+        run_id = time.strftime("%Y%m%dT%H%M%S")
+        write_partitions(to_typed_frame(unique_rows, codes), args.out, run_id)
+        append_exported_keys(args.out, new_keys)
+    save_state(args.out, new_state) # Only after the Parquet files are written
+    print(f"Exported {len(unique_rows)} rows to {os.path.join(args.out, 'responses')}")
+
+
+def summary(args):
+    require_pyarrow()
+    import pyarrow.dataset as ds
+    dataset = open_dataset(os.path.join(args.out, "responses"))
+    flt = ds.field("study_phase") == args.study_phase if args.study_phase else None
+    df = dataset.to_table(columns=["sample_id", "question_id", "choice_code"], filter=flt).to_pandas()
+    stats = df.groupby(["sample_id", "question_id"], observed=True, dropna=False)["choice_code"].agg(["count", "mean", "std"])
+    with pd.option_context("display.max_rows", None, "display.max_colwidth", 60):
+        print(stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export collected responses to partitioned Parquet.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_sync = sub.add_parser("sync", help="export rows added since the last run")
+    p_sync.add_argument("--jsonl", action="append", default=[], help="JSONL response file (repeatable)")
+    p_sync.add_argument("--sqlite", action="append", default=[], help="SQLite response database (repeatable)")
+    p_sync.add_argument("--sheet", action="store_true", help="also read the Google Sheet")
+    p_sync.add_argument("--sheet-name", default=DEFAULT_SHEET_NAME)
+    p_sync.add_argument("--out", default=DEFAULT_OUT_DIR)
+    p_sync.set_defaults(func=sync)
+    p_summary = sub.add_parser("summary", help="per-caption Likert statistics from the exported dataset")
+    p_summary.add_argument("--study-phase")
+    p_summary.add_argument("--out", default=DEFAULT_OUT_DIR)
+    p_summary.set_defaults(func=summary)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,516 @@
+# media_index.py
+"""On-disk index of study video metadata, built offline.
+
+The app reads orientation and duration for every study and quiz clip at
+startup. Rather than probing each MP4 on every cold start, this tool records
+the metadata once in media_index.json and the app looks it up by path:
+
+    python media_index.py build                        # media/*.mp4 plus every clip in the data files
+    python media_index.py build --data study_data_full.json
+    python media_index.py transcode                    # downscaled renditions under media/renditions/ (needs ffmpeg)
+    python media_index.py posters                      # poster frames under media/posters/ (needs OpenCV; shown only with a media server)
+    python media_index.py verify media/intro_to_tone.mp4  # exits 1 if a used clip is missing or stale
+    python media_index.py show media/start_video_slower.mp4
+
+An entry stays valid while the file's size and mtime are unchanged. If only
+the mtime differs (e.g. after a fresh clone), the content hash decides, and
+build saves the new mtime. The app skips the hash and trusts a matching size,
+since every deploy resets the mtimes; run verify to compare content.
+
+Renditions are opt-in: media_index.json ships without any, and until transcode
+has been run (and its output deployed) the app plays every source clip as is.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from mp4_header import MP4Error, is_faststart, read_mp4_header
+
+DEFAULT_INDEX_PATH = "media_index.json"
+DEFAULT_DATA_PATTERNS = ["study_data*.json", "quiz_data.json"]
+MEDIA_DIR = "media"
+INDEX_VERSION = 2
+DEFAULT_METADATA = {"orientation": "landscape", "duration": 10} # Used when a video cannot be read
+MAX_PROBE_WORKERS = min(8, os.cpu_count() or 1)
+RENDITIONS_DIR = os.path.join(MEDIA_DIR, "renditions")
+POSTERS_DIR = os.path.join(MEDIA_DIR, "posters")
+POSTER_MAX_SIDE = 640
+DERIVED_FIELDS = ("renditions", "poster") # Made from a clip by transcode/posters, kept when it is re-probed
+# Shorter side in pixels; a placeholder until renditions are actually deployed, pass --sizes to
+# encode others. The clips are 448-720 px on the shorter side (landscape) and 252-398 px (portrait),
+# and transcode never upscales, so only a size below that range yields a rendition.
+DEFAULT_RENDITION_SIZES = [360]
+DEFAULT_RENDITION_CRF = 26
+
+
+def normalize_path(path):
+    """Index key for a video path: relative paths as written in the data files, with forward slashes."""
+    return os.path.normpath(path).replace(os.sep, "/")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def probe_video(path):
+    """Reads a video's properties from its MP4 header. Returns None if the file cannot be read.
+
+    Files that are not MP4 are handed to OpenCV, when it is installed (requirements-media.txt).
+    """
+    try:
+        header = read_mp4_header(path)
+        header["faststart"] = is_faststart(path)
+    except MP4Error:
+        header = _probe_with_opencv(path)
+    except OSError:
+        return None
+    if header is None:
+        return None
+    duration_s = header["duration_s"]
+    width, height, fps = header["width"], header["height"], header["fps"]
+    return {
+        "orientation": "portrait" if height > width else "landscape",
+        "duration": math.ceil(duration_s) if duration_s else DEFAULT_METADATA["duration"],
+        "duration_s": round(duration_s, 3) if duration_s else None,
+        "width": width, "height": height, "rotation": header.get("rotation", 0),
+        "fps": round(fps, 3) if fps else None, "codec": header["codec"], "faststart": header.get("faststart"),
+        "bitrate_kbps": round(os.path.getsize(path) * 8 / duration_s / 1000) if duration_s else None,
+    }
+
+
+def _probe_with_opencv(path):
+    try:
+        import cv2
+    except ImportError:
+        return None
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            return None
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+        return {
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "duration_s": frame_count / fps if fps > 0 and frame_count > 0 else None, "fps": fps if fps > 0 else None,
+            "codec": "".join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4)).strip("\x00 ") or None,
+        }
+    finally:
+        cap.release()
+
+
+class MediaIndex:
+    """Video metadata keyed by path, validated against the file's size and mtime.
+
+    With check_content=False an entry whose mtime changed is trusted on its size alone
+    instead of re-hashing the file.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, check_content=True):
+        self.path = path
+        self.check_content = check_content
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                self.entries = data.get("videos", {})
+
+    def lookup(self, path):
+        """Returns the indexed metadata for a video, or None if it is missing or out of date."""
+        entry = self.entries.get(normalize_path(path))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if stat.st_size != entry["size"]:
+            return None
+        if stat.st_mtime_ns != entry["mtime_ns"] and self.check_content:
+            # Checkouts and copies reset the mtime; the content hash says whether the file changed
+            if file_sha256(path) != entry["sha256"]:
+                return None
+            entry["mtime_ns"] = stat.st_mtime_ns
+        return entry
+
+    def add(self, path, metadata):
+        stat = os.stat(path)
+        key = normalize_path(path)
+        entry = dict(metadata, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=file_sha256(path))
+        for field in DERIVED_FIELDS:
+            if field in self.entries.get(key, {}):
+                entry[field] = self.entries[key][field] # Checked against the source hash on use
+        self.entries[key] = entry
+
+    def playback_path(self, path, min_short_sides):
+        """The smallest current rendition big enough for the player, else the clip itself.
+
+        min_short_sides maps an orientation to the shorter side (in pixels) a rendition needs.
+        """
+        entry = self.lookup(path)
+        if entry is None or entry["orientation"] not in min_short_sides:
+            return path
+        min_short_side = min_short_sides[entry["orientation"]]
+        candidates = [r for r in entry.get("renditions", [])
+                      if r["source_sha256"] == entry["sha256"] and min(r["width"], r["height"]) >= min_short_side
+                      and r["size"] < entry["size"] and os.path.exists(r["path"])]
+        return min(candidates, key=lambda r: r["size"])["path"] if candidates else path
+
+    def poster_path(self, path):
+        """Path of the clip's poster frame, or None if there is none for its current content."""
+        entry = self.lookup(path)
+        poster = entry.get("poster") if entry else None
+        if poster and os.path.basename(poster["path"]).startswith(poster_key(entry)) and _has_size(poster["path"], poster["size"]):
+            return poster["path"]
+        return None
+
+    def content_hash(self, path):
+        """sha256 of an indexed clip, rendition or poster as it is on disk, or None if it is not indexed."""
+        key = normalize_path(path)
+        if key in self.entries:
+            entry = self.lookup(path)
+            return entry["sha256"] if entry else None
+        for entry in self.entries.values():
+            for record in entry.get("renditions", []) + ([entry["poster"]] if entry.get("poster") else []):
+                if record["path"] == key:
+                    return record["sha256"] if _has_size(path, record["size"]) else None
+        return None
+
+    def check_files(self, paths):
+        """{path: problem} for the given media files that are missing, not indexed, or not the size the index records.
+
+        Only stats the files, so it is cheap enough for app startup; `verify` also compares content hashes.
+        """
+        problems = {}
+        for path in dict.fromkeys(paths):
+            entry = self.entries.get(normalize_path(path))
+            if not os.path.isfile(path):
+                problems[path] = "missing"
+            elif entry is None:
+                problems[path] = "not indexed"
+            elif os.path.getsize(path) != entry["size"]:
+                problems[path] = "changed since the index was built"
+        return problems
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "built_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "videos": dict(sorted(self.entries.items()))}, f, indent=2)
+            f.write("\n")
+        os.replace(tmp_path, self.path)
+
+
+def describe_videos(paths, index=None, max_workers=None):
+    """Metadata for each distinct path, from the index when up to date and probed otherwise.
+
+    Lookups and probes run in a thread pool (both are file I/O: a stat, a hash or a header
+    read). Returns {path: metadata}; paths that are missing or unreadable map to None.
+    """
+    unique = list(dict.fromkeys(paths))
+
+    def describe(path):
+        if not os.path.exists(path):
+            return None
+        entry = index.lookup(path) if index is not None else None
+        return entry if entry is not None else probe_video(path)
+
+    if len(unique) <= 1:
+        return {path: describe(path) for path in unique}
+    with ThreadPoolExecutor(max_workers=max_workers or min(MAX_PROBE_WORKERS, len(unique))) as pool:
+        return dict(zip(unique, pool.map(describe, unique)))
+
+
+SHARED_MEDIA_FIELDS = ("video_summary", "road_event_answer", "distractor_answers")
+
+
+def build_media_registry(items, metadata):
+    """Moves per-video fields out of study/quiz items into one shared record per video_path.
+
+    Orientation and duration come from `metadata` ({path: {orientation, duration}}). A
+    SHARED_MEDIA_FIELDS value moves only if every item showing that video agrees on it;
+    otherwise the items keep their own values. Returns {video_path: record}.
+    """
+    by_path = {}
+    for item in items:
+        if item.get("video_path"):
+            by_path.setdefault(item["video_path"], []).append(item)
+    registry = {}
+    for path, path_items in by_path.items():
+        record = {"video_path": path, **metadata.get(path, DEFAULT_METADATA)}
+        for field in SHARED_MEDIA_FIELDS:
+            values = [item[field] for item in path_items if field in item]
+            if values and len(values) == len(path_items) and all(v == values[0] for v in values):
+                record[field] = values[0]
+                for item in path_items:
+                    del item[field]
+        registry[path] = record
+    return registry
+
+
+def _has_size(path, size):
+    try:
+        return os.path.getsize(path) == size
+    except OSError:
+        return False
+
+
+def poster_key(entry):
+    """Posters are cached by content hash, so an unchanged clip keeps its poster across renames and re-probes."""
+    return entry["sha256"][:20]
+
+
+def extract_poster(path, output, max_side=POSTER_MAX_SIDE, quality=80, samples=5):
+    """Saves a representative frame of a clip as a small JPEG or WebP (by the output's extension).
+
+    Samples a few frames from the first half of the clip and keeps the sharpest, so a
+    black fade-in or a motion-blurred frame is not picked.
+    """
+    import cv2
+    cap = cv2.VideoCapture(path)
+    best, best_score = None, -1.0
+    try:
+        frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        for i in range(samples):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(frame_count * (0.1 + 0.4 * i / max(1, samples - 1))))
+            ok, frame = cap.read()
+            if not ok:
+                continue
+            score = cv2.Laplacian(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), cv2.CV_64F).var()
+            if score > best_score:
+                best, best_score = frame, score
+    finally:
+        cap.release()
+    if best is None:
+        raise ValueError(f"No decodable frame in {path}")
+    height, width = best.shape[:2]
+    scale = max_side / max(height, width)
+    if scale < 1:
+        best = cv2.resize(best, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    extension = os.path.splitext(output)[1]
+    params = [cv2.IMWRITE_WEBP_QUALITY, quality] if extension == ".webp" else [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    ok, data = cv2.imencode(extension, best, params)
+    if not ok:
+        raise ValueError(f"Could not encode {output}")
+    tmp_output = output + ".tmp"
+    with open(tmp_output, "wb") as f:
+        f.write(data.tobytes())
+    os.replace(tmp_output, output)
+
+
+def poster_record(path):
+    return {"path": path, "size": os.path.getsize(path), "sha256": file_sha256(path)}
+
+
+def video_paths_in(data_files):
+    """Every video_path referenced by the given study/quiz data files, in first-seen order."""
+    paths = []
+    for data_file in data_files:
+        with open(data_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for items in data.values():
+            for item in items if isinstance(items, list) else []:
+                if isinstance(item, dict) and item.get("video_path"):
+                    paths.append(item["video_path"])
+    return list(dict.fromkeys(paths))
+
+
+# --- Commands ---
+def build(args):
+    index = MediaIndex(args.index)
+    paths = video_paths_in(args.data) + sorted(glob.glob(os.path.join(MEDIA_DIR, "*.mp4")))
+
+    def refresh(path):
+        if not os.path.exists(path):
+            return "missing"
+        if not args.force and index.lookup(path) is not None:
+            return "up to date"
+        metadata = probe_video(path)
+        if metadata is None:
+            return "unreadable"
+        index.add(path, metadata)
+        return "probed"
+
+    unique = list(dict.fromkeys(normalize_path(p) for p in paths))
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        outcomes = dict(zip(unique, pool.map(refresh, unique)))
+    for path, outcome in outcomes.items():
+        if outcome in ("missing", "unreadable"):
+            print(f"{outcome}: {path}", file=sys.stderr)
+    counts = Counter(outcomes.values())
+    index.save()
+    print(f"{args.index}: {len(index.entries)} videos ({counts['probed']} probed, {counts['up to date']} up to date, "
+          f"{counts['missing']} missing, {counts['unreadable']} unreadable)")
+
+
+def rendition_path(path, short_side):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return normalize_path(os.path.join(RENDITIONS_DIR, f"{stem}_{short_side}p.mp4"))
+
+
+def transcode_rendition(source, entry, short_side, output, crf, keep_audio=False):
+    """Encodes one downscaled H.264 rendition with the moov atom up front. Returns its index record."""
+    # Scale the shorter side; -2 keeps the aspect ratio with an even length for yuv420p
+    scale = f"scale=-2:{short_side}" if entry["orientation"] == "landscape" else f"scale={short_side}:-2"
+    command = ["ffmpeg", "-y", "-loglevel", "error", "-i", source, "-vf", scale,
+               "-c:v", "libx264", "-preset", "slow", "-crf", str(crf), "-pix_fmt", "yuv420p",
+               "-movflags", "+faststart"]
+    command += ["-c:a", "aac", "-b:a", "96k"] if keep_audio else ["-an"] # The app always plays clips muted
+    tmp_output = output + ".tmp.mp4"
+    subprocess.run(command + [tmp_output], check=True)
+    os.replace(tmp_output, output)
+    header = read_mp4_header(output)
+    return {"path": output, "width": header["width"], "height": header["height"], "size": header["size"],
+            "bitrate_kbps": round(header["size"] * 8 / header["duration_s"] / 1000) if header["duration_s"] else None,
+            "sha256": file_sha256(output), "source_sha256": entry["sha256"]}
+
+
+def transcode(args):
+    if shutil.which("ffmpeg") is None:
+        sys.exit("media_index.py transcode needs ffmpeg on the PATH")
+    index = MediaIndex(args.index)
+    os.makedirs(RENDITIONS_DIR, exist_ok=True)
+    jobs = []
+    for path in sorted(index.entries):
+        entry = index.lookup(path)
+        if entry is None:
+            print(f"skipped (missing or changed, run build first): {path}", file=sys.stderr)
+            continue
+        current = {r["path"]: r for r in entry.get("renditions", []) if r["source_sha256"] == entry["sha256"]}
+        for short_side in args.sizes:
+            output = rendition_path(path, short_side)
+            if short_side >= min(entry["width"], entry["height"]):
+                continue # Never upscale
+            if args.force or output not in current or not os.path.exists(output):
+                jobs.append((path, entry, short_side, output))
+
+    def run(job):
+        path, entry, short_side, output = job
+        try:
+            return job, transcode_rendition(path, entry, short_side, output, args.crf, args.keep_audio)
+        except (subprocess.CalledProcessError, MP4Error, OSError) as e:
+            print(f"failed: {output}: {e}", file=sys.stderr)
+            return job, None
+
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(run, jobs))
+    for (path, entry, short_side, output), rendition in results:
+        if rendition is None:
+            continue
+        renditions = [r for r in entry.get("renditions", []) if r["path"] != output and r["source_sha256"] == entry["sha256"]]
+        entry["renditions"] = sorted(renditions + [rendition], key=lambda r: r["size"])
+        print(f"{output}: {rendition['width']}x{rendition['height']}, {rendition['size'] / entry['size']:.0%} of the source")
+    index.save()
+    print(f"{args.index}: {sum(r is not None for _, r in results)} of {len(jobs)} renditions encoded")
+
+
+def posters(args):
+    try:
+        import cv2 # noqa: F401
+    except ImportError:
+        sys.exit("media_index.py posters needs OpenCV: pip install -r requirements-media.txt")
+    index = MediaIndex(args.index)
+    os.makedirs(POSTERS_DIR, exist_ok=True)
+    jobs = []
+    for path in sorted(index.entries):
+        entry = index.lookup(path)
+        if entry is None:
+            print(f"skipped (missing or changed, run build first): {path}", file=sys.stderr)
+            continue
+        output = normalize_path(os.path.join(POSTERS_DIR, f"{poster_key(entry)}.{args.format}"))
+        if os.path.exists(output) and not args.force:
+            entry["poster"] = poster_record(output) # Same content as a clip already done
+        else:
+            jobs.append((path, entry, output))
+
+    def run(job):
+        path, entry, output = job
+        try:
+            extract_poster(path, output, args.max_side, args.quality)
+            return output
+        except (ValueError, OSError) as e:
+            print(f"failed: {path}: {e}", file=sys.stderr)
+            return None
+
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        for (path, entry, _), output in zip(jobs, pool.map(run, jobs)):
+            if output:
+                entry["poster"] = poster_record(output)
+                print(f"{output}: {os.path.getsize(output) / 1024:.0f} KB poster for {path}")
+    index.save()
+    print(f"{args.index}: {sum('poster' in e for e in index.entries.values())} videos have a poster ({len(jobs)} extracted)")
+
+
+def verify(args):
+    """Exits non-zero if a clip the data files use is missing, unindexed or changed since the last build."""
+    index = MediaIndex(args.index)
+    paths = list(dict.fromkeys(normalize_path(p) for p in video_paths_in(args.data) + args.paths))
+    problems = index.check_files(paths)
+    for path in paths:
+        if path not in problems and index.lookup(path) is None:
+            problems[path] = "changed since the index was built" # Same size, different content
+    for path, problem in problems.items():
+        print(f"{problem}: {path}")
+    print(f"{args.index}: {len(problems)} problem(s)")
+    sys.exit(1 if problems else 0)
+
+
+def show(args):
+    index = MediaIndex(args.index)
+    for path in args.paths:
+        entry = index.lookup(path)
+        print(f"{path}: {json.dumps(entry) if entry else 'not indexed or out of date'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and inspect the video metadata index.")
+    parser.add_argument("--index", default=DEFAULT_INDEX_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_build = sub.add_parser("build", help="probe new or changed videos and write the index")
+    p_build.add_argument("--data", action="append", default=None, help=f"study/quiz data file (repeatable; default {' '.join(DEFAULT_DATA_PATTERNS)})")
+    p_build.add_argument("--force", action="store_true", help="re-probe every video")
+    p_build.add_argument("--jobs", type=int, default=MAX_PROBE_WORKERS, help="videos probed in parallel")
+    p_build.set_defaults(func=build)
+    p_transcode = sub.add_parser("transcode", help="encode downscaled faststart H.264 renditions of indexed videos (needs ffmpeg)")
+    p_transcode.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_RENDITION_SIZES, help="shorter side of each rendition in pixels")
+    p_transcode.add_argument("--crf", type=int, default=DEFAULT_RENDITION_CRF, help="x264 quality (lower is better and larger)")
+    p_transcode.add_argument("--keep-audio", action="store_true")
+    p_transcode.add_argument("--force", action="store_true", help="re-encode existing renditions")
+    p_transcode.add_argument("--jobs", type=int, default=max(1, MAX_PROBE_WORKERS // 2), help="ffmpeg processes run in parallel")
+    p_transcode.set_defaults(func=transcode)
+    p_posters = sub.add_parser("posters", help="extract a poster frame per indexed video (needs OpenCV)")
+    p_posters.add_argument("--format", choices=["webp", "jpg"], default="webp")
+    p_posters.add_argument("--max-side", type=int, default=POSTER_MAX_SIDE)
+    p_posters.add_argument("--quality", type=int, default=80)
+    p_posters.add_argument("--force", action="store_true", help="re-extract existing posters")
+    p_posters.add_argument("--jobs", type=int, default=MAX_PROBE_WORKERS)
+    p_posters.set_defaults(func=posters)
+    p_verify = sub.add_parser("verify", help="check that every clip the data files use is present and indexed")
+    p_verify.add_argument("--data", action="append", default=None, help="study/quiz data file (repeatable)")
+    p_verify.add_argument("paths", nargs="*", help="other media files to check")
+    p_verify.set_defaults(func=verify)
+    p_show = sub.add_parser("show", help="print the indexed metadata of videos")
+    p_show.add_argument("paths", nargs="+")
+    p_show.set_defaults(func=show)
+    args = parser.parse_args()
+    if args.command in ("build", "verify") and args.data is None:
+        args.data = [p for pattern in DEFAULT_DATA_PATTERNS for p in sorted(glob.glob(pattern))]
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
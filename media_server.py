@@ -0,0 +1,224 @@
+# media_server.py
+"""Static file server for the study clips, with byte ranges and HTTP caching.
+
+st.video(path) makes Streamlit read the whole MP4 into memory and serve it
+from its media file manager. With a media server the app passes URLs
+instead, so the browser streams clips with range requests and caches them:
+
+    python media_server.py --dir media --port 8502
+
+and set ROADTONES_MEDIA_URL (or base_url in a [media] table in
+.streamlit/secrets.toml) to the URL that reaches it from participants'
+browsers, e.g. https://media.example.org/. The app can also start it
+in-process: set serve_port in the [media] table, together with base_url.
+"""
+import argparse
+import email.utils
+import hashlib
+import logging
+import mimetypes
+import os
+import posixpath
+import threading
+import urllib.parse
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8502
+DEFAULT_MAX_AGE = 86400
+IMMUTABLE_MAX_AGE = 365 * 86400 # For ?v=<content hash> URLs, whose content never changes
+CHUNK_SIZE = 256 * 1024
+
+_hashes = {} # path -> (size, mtime_ns, sha256)
+_hashes_lock = threading.Lock()
+
+mimetypes.add_type("video/mp4", ".mp4")
+mimetypes.add_type("image/webp", ".webp")
+
+
+def parse_range(header, size):
+    """Returns (start, end) inclusive for a single "bytes=" range, None to serve the whole file.
+
+    Raises ValueError for a range that cannot be satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None # Other units and multipart ranges: answer with the full file
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first: # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise ValueError(header)
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None # Malformed; ignore the header as RFC 9110 allows
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+def content_hash(path, stat):
+    """sha256 of a file, computed once per (size, mtime) and remembered."""
+    with _hashes_lock:
+        cached = _hashes.get(path)
+    if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    with _hashes_lock:
+        _hashes[path] = (stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+    return digest.hexdigest()
+
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    """Serves files below `directory` with Range, ETag, Last-Modified and Cache-Control support.
+
+    The ETag is the content hash, so it survives redeploys that reset mtimes. A request whose
+    ?v= matches the start of the content hash is cacheable for a year as immutable.
+    """
+
+    server_version = "RoadtonesMedia/1.0"
+    protocol_version = "HTTP/1.1" # Keep-alive, so a seeking player reuses its connection
+    directory = "media"
+    max_age = DEFAULT_MAX_AGE
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _resolve(self):
+        """File path for the request URL, or None if it is outside the media directory."""
+        url_path = posixpath.normpath(urllib.parse.unquote(urllib.parse.urlsplit(self.path).path))
+        parts = [p for p in url_path.split("/") if p and p not in (".", "..")]
+        path = os.path.join(os.path.abspath(self.directory), *parts)
+        return path if os.path.isfile(path) else None
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body):
+        path = self._resolve()
+        if path is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        stat = os.stat(path)
+        size = stat.st_size
+        sha256 = content_hash(path, stat)
+        etag = f'"{sha256[:32]}"'
+        last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        version = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query).get("v", [""])[0]
+        self._immutable = len(version) >= 8 and sha256.startswith(version)
+
+        if self._not_modified(etag, stat.st_mtime):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self._send_cache_headers(etag, last_modified)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        byte_range = None
+        range_header = self.headers.get("Range")
+        if range_header and self._if_range_matches(etag, last_modified):
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+        start, end = byte_range or (0, size - 1)
+        length = max(0, end - start + 1)
+        self.send_response(HTTPStatus.PARTIAL_CONTENT if byte_range else HTTPStatus.OK)
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self._send_cache_headers(etag, last_modified)
+        self.end_headers()
+        if send_body and length:
+            self._send_bytes(path, start, length)
+
+    def _send_cache_headers(self, etag, last_modified):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        if self._immutable:
+            self.send_header("Cache-Control", f"public, max-age={IMMUTABLE_MAX_AGE}, immutable")
+        else:
+            self.send_header("Cache-Control", f"public, max-age={self.max_age}")
+        self.send_header("Access-Control-Allow-Origin", "*")
+
+    def _not_modified(self, etag, mtime):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return if_none_match.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _if_range_matches(self, etag, last_modified):
+        if_range = self.headers.get("If-Range")
+        return if_range is None or if_range.strip() in (etag, last_modified)
+
+    def _send_bytes(self, path, start, length):
+        with open(path, "rb") as f:
+            f.seek(start)
+            try:
+                while length > 0:
+                    chunk = f.read(min(CHUNK_SIZE, length))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    length -= len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                pass # The player seeked elsewhere and dropped this request
+
+
+def make_server(directory, host="0.0.0.0", port=DEFAULT_PORT, max_age=DEFAULT_MAX_AGE):
+    handler = type("BoundMediaRequestHandler", (MediaRequestHandler,), {"directory": directory, "max_age": max_age})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_background(directory, host="0.0.0.0", port=DEFAULT_PORT, max_age=DEFAULT_MAX_AGE):
+    """Starts a media server on a daemon thread and returns it."""
+    server = make_server(directory, host, port, max_age)
+    threading.Thread(target=server.serve_forever, name="media-server", daemon=True).start()
+    logger.info("Serving %s on %s:%d", directory, host, server.server_address[1])
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve study media with range requests and caching headers.")
+    parser.add_argument("--dir", default="media")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-age", type=int, default=DEFAULT_MAX_AGE, help="Cache-Control max-age in seconds")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = make_server(args.dir, args.host, args.port, args.max_age)
+    print(f"Serving {os.path.abspath(args.dir)} at http://{args.host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# mp4_header.py
+"""Reads duration, dimensions and rotation from an MP4 (ISO-BMFF) file's moov box.
+
+Only box headers are read while walking the file; the media data (mdat) is
+seeked over, never decoded. Unlike OpenCV's frame properties, this also
+honours the rotation in the track header matrix, so a phone clip stored as
+1920x1080 with a 90 degree rotation is reported as portrait.
+"""
+import math
+import os
+import struct
+
+_CODEC_NAMES = {"avc1": "h264", "avc3": "h264", "hvc1": "hevc", "hev1": "hevc", "av01": "av1", "vp09": "vp9"}
+
+
+class MP4Error(ValueError):
+    """The file is not an MP4 this reader understands."""
+
+
+def _iter_boxes(f, start, end):
+    """Yields (type, payload_offset, payload_end) for each box between start and end, seeking only."""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            large_size = f.read(8)
+            if len(large_size) < 8:
+                raise MP4Error(f"Truncated {box_type!r} box header at offset {pos}")
+            size = struct.unpack(">Q", large_size)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos # Box runs to the end of the file
+        if size < header_size:
+            raise MP4Error(f"Invalid {box_type!r} box size {size} at offset {pos}")
+        yield box_type, pos + header_size, min(pos + size, end)
+        pos += size
+
+
+def _read_moov(f, file_size):
+    """Payload of the top-level moov box; it holds only headers and sample tables, not media data."""
+    for box_type, start, end in _iter_boxes(f, 0, file_size):
+        if box_type == b"moov":
+            f.seek(start)
+            return f.read(end - start)
+    raise MP4Error("No moov box")
+
+
+def is_faststart(path):
+    """True if the moov box comes before the media data, so playback can start before the download ends."""
+    with open(path, "rb") as f:
+        for box_type, _, _ in _iter_boxes(f, 0, os.path.getsize(path)):
+            if box_type in (b"moov", b"mdat"):
+                return box_type == b"moov"
+    return False
+
+
+def _children(data, start=0, end=None):
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, pos)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size:
+            raise MP4Error(f"Invalid {box_type!r} box size {size}")
+        yield box_type, pos + header_size, min(pos + size, end)
+        pos += size
+
+
+def _find(data, start, end, path):
+    """Payload (start, end) of the first box along a path of box types, or None."""
+    for box_type, child_start, child_end in _children(data, start, end):
+        if box_type == path[0]:
+            return (child_start, child_end) if len(path) == 1 else _find(data, child_start, child_end, path[1:])
+    return None
+
+
+def _timescale_duration(data, start):
+    """(timescale, duration) from an mvhd or mdhd payload."""
+    version = data[start]
+    if version == 1:
+        return struct.unpack_from(">IQ", data, start + 4 + 16)
+    return struct.unpack_from(">II", data, start + 4 + 8)
+
+
+def _parse_tkhd(data, start):
+    """(rotation in degrees, width, height) from a tkhd payload."""
+    version = data[start]
+    offset = start + 4 + (32 if version == 1 else 20) + 8 + 8 # Times, ids and duration; reserved; layer/group/volume
+    matrix = struct.unpack_from(">9i", data, offset)
+    width, height = struct.unpack_from(">II", data, offset + 36)
+    a, b = matrix[0] / 65536, matrix[1] / 65536
+    rotation = round(math.degrees(math.atan2(b, a))) % 360
+    return rotation, width / 65536, height / 65536
+
+
+def _parse_video_track(data, start, end):
+    """Metadata of a trak box if it is a video track, else None."""
+    hdlr = _find(data, start, end, [b"mdia", b"hdlr"])
+    if hdlr is None or data[hdlr[0] + 8:hdlr[0] + 12] != b"vide":
+        return None
+    tkhd = _find(data, start, end, [b"tkhd"])
+    mdhd = _find(data, start, end, [b"mdia", b"mdhd"])
+    if tkhd is None or mdhd is None:
+        raise MP4Error("Video track without tkhd/mdhd")
+    rotation, width, height = _parse_tkhd(data, tkhd[0])
+    timescale, duration = _timescale_duration(data, mdhd[0])
+    track = {"rotation": rotation, "width": round(width), "height": round(height),
+             "duration_s": duration / timescale if timescale else None, "codec": None, "frame_count": None}
+    stbl = _find(data, start, end, [b"mdia", b"minf", b"stbl"])
+    if stbl is not None:
+        stsd = _find(data, stbl[0], stbl[1], [b"stsd"])
+        if stsd is not None and stsd[1] - stsd[0] >= 16:
+            fourcc = data[stsd[0] + 12:stsd[0] + 16].decode("latin-1")
+            track["codec"] = _CODEC_NAMES.get(fourcc, fourcc.strip())
+        stsz = _find(data, stbl[0], stbl[1], [b"stsz"])
+        if stsz is not None:
+            track["frame_count"] = struct.unpack_from(">I", data, stsz[0] + 8)[0]
+    return track
+
+
+def read_mp4_header(path):
+    """Returns duration, dimensions, rotation, fps and codec of an MP4's first video track.
+
+    width and height are the displayed size, i.e. swapped for 90/270 degree rotations.
+    Raises MP4Error if the file has no readable moov box or video track.
+    """
+    try:
+        return _read_header(path)
+    except struct.error as e: # Truncated box
+        raise MP4Error(f"Truncated MP4 header: {e}") from e
+
+
+def _read_header(path):
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        moov = _read_moov(f, file_size)
+    mvhd = _find(moov, 0, len(moov), [b"mvhd"])
+    movie_duration_s = None
+    if mvhd is not None:
+        timescale, duration = _timescale_duration(moov, mvhd[0])
+        movie_duration_s = duration / timescale if timescale and duration else None
+    for box_type, start, end in _children(moov):
+        if box_type != b"trak":
+            continue
+        track = _parse_video_track(moov, start, end)
+        if track is None:
+            continue
+        duration_s = track["duration_s"] or movie_duration_s
+        width, height = track["width"], track["height"]
+        if track["rotation"] in (90, 270):
+            width, height = height, width
+        fps = track["frame_count"] / duration_s if duration_s and track["frame_count"] else None
+        return {"duration_s": duration_s, "width": width, "height": height, "rotation": track["rotation"],
+                "fps": fps, "frame_count": track["frame_count"], "codec": track["codec"], "size": file_size}
+    raise MP4Error("No video track")
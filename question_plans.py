@@ -0,0 +1,191 @@
+# question_plans.py
+"""Compiles every study item's questions into a render plan when the data is loaded.
+
+The question pages rerun on every slider move. Instead of resolving templates, style
+overrides and trait highlighting on each rerun, they look up the item's plan:
+
+    part1: {caption_id: {"questions": [...], "terms": [...]}}
+    part2: {change_id: {"question_html", "question_text", "error", "terms"}}
+    part3: {comparison_id: {"questions": [...], "terms": [...]}}
+
+A slider question is {"id", "text", "options", "label_html"}; "text" is what gets saved
+with the answer, "label_html" the heading shown above the slider. "terms" are the
+definitions listed in the reference box, sorted, and "reference_html" the box itself.
+Quiz questions get their reference boxes too:
+
+    quiz: {part_key: [[reference_html or None for each question] for each sample]}
+"""
+import re
+
+from response_store import LIKERT_OPTIONS
+
+PART1_QUESTION_IDS = ["tone_relevance", "style_relevance", "overall_relevance", "factual_consistency", "usefulness", "human_likeness"]
+PART3_QUESTION_IDS = ["part3_tone_relevance", "part3_style_relevance", "part3_factual_consistency"]
+PART2_FACTUAL_QUESTION = "Is the core factual content consistent across both captions (refer to video and summary)?"
+
+TONE_COLOR = "#000099" # Blue
+STYLE_COLOR = "#663300" # Brown
+SUPER_LABELS = {"tone_relevance": ("Tone", TONE_COLOR), "style_relevance": ("Style", STYLE_COLOR)}
+PART2_TEMPLATE_KEYS = {"writing_style": "Writing Style", "tone": "Tone"}
+
+OVERALL_RELEVANCE_TEXT = (
+    f"How relevant are the <span style='color:{TONE_COLOR};'><b>Tone</b></span> and <span style='color:{STYLE_COLOR};'><b>Style</b></span> "
+    "for the given video? <span style='font-size: 0.9rem; font-weight: 500;'>(e.g., for a Traffic Authority, social media influencer or for yourself)</span>"
+)
+DEFAULT_TEMPLATES = {
+    "tone_relevance": "How {} does the caption sound?",
+    "factual_consistency": "How factually accurate is the caption (refer to video and summary)?",
+    "usefulness": "How useful would this caption be for {}?",
+    "human_likeness": "How human-like does this caption sound?",
+}
+DEFAULT_STYLE_TEXT = "How {} is the caption's style?"
+DEFAULT_STYLE_OPTIONS = ["Not at all", "Weak", "Moderate", "Strong", "Very Strong"]
+
+
+class ReferenceBoxes:
+    """Renders the reference box for a set of terms while the plans are compiled; items sharing a term set share the HTML."""
+
+    def __init__(self, definitions):
+        self.definitions = definitions
+        self._rendered = {} # frozenset of terms -> HTML
+
+    def __call__(self, terms):
+        terms = frozenset(terms)
+        if terms not in self._rendered:
+            items = "".join(f"<li><strong>{term}:</strong> {self.definitions.get(term, 'Definition not found.')}</li>" for term in sorted(terms) if self.definitions.get(term))
+            self._rendered[terms] = '<div class="reference-box"><h3>Reference</h3><ul>' + items + "</ul></div>"
+        return self._rendered[terms]
+
+
+def format_traits(traits, color_hex):
+    """Traits in bold and colour, joined with "and"."""
+    highlighted = [f"<b style='color:{color_hex}; font-weight: 700;'>{trait}</b>" for trait in traits]
+    if len(highlighted) > 1: return " and ".join(highlighted)
+    return highlighted[0] if highlighted else ""
+
+
+def _template_text(templates, question_id):
+    return next((q['text'] for q in templates if q['id'] == question_id), DEFAULT_TEMPLATES[question_id])
+
+
+def _style_question(templates, style_traits):
+    """(text, options, reference terms) of the style question; the first trait with an override wins."""
+    template = next((q for q in templates if q['id'] == 'style_relevance'), None)
+    overrides = template.get('overrides', {}) if template else {}
+    for trait in style_traits:
+        if trait in overrides:
+            text = overrides[trait]['text'].replace("<b class='highlight-trait'>", f"<b style='color:{STYLE_COLOR}; font-weight: 700;'>")
+            return text, overrides[trait]['options'], [trait]
+    default_text, default_options = DEFAULT_STYLE_TEXT, DEFAULT_STYLE_OPTIONS
+    if template:
+        default_text = template.get('default_text', default_text)
+        default_options = template.get('default_options', default_options)
+    return default_text.format(format_traits(style_traits, STYLE_COLOR)), default_options, list(style_traits)
+
+
+def _slider_question(question_id, base_id, index, text, options):
+    label, color = SUPER_LABELS.get(base_id, (None, None))
+    if label:
+        super_label = f"<div class='question-super-label' style='color: {color};'>{label}</div>"
+    else:
+        super_label = "<div class='question-super-label'>&nbsp;</div>" # Keeps the sliders aligned
+    label_html = f"<div class='slider-label'>{super_label}<div class='slider-question-text'><strong>{index + 1}. {text}</strong></div></div>"
+    return {"id": question_id, "text": text, "options": options, "label_html": label_html}
+
+
+def quiz_reference_terms(part_key, sample, question_data):
+    """Terms defined under a quiz question: the compared tone, the application if the question names it, or the options."""
+    if "Tone Controllability" in part_key:
+        return [sample['tone_to_compare']]
+    if "Caption Quality" in part_key:
+        app_trait = sample.get("application")
+        return [app_trait] if app_trait and app_trait in question_data["question_text"] else []
+    return list(question_data['options'])
+
+
+def compile_quiz_plans(quiz, reference_boxes):
+    """Reference-box HTML per quiz question (None if it has no terms), by part key and sample index."""
+    plans = {}
+    for part_key, samples in quiz.items():
+        plans[part_key] = []
+        for sample in samples:
+            questions = sample["questions"] if "Caption Quality" in part_key else [sample]
+            terms = [quiz_reference_terms(part_key, sample, question_data) for question_data in questions]
+            plans[part_key].append([reference_boxes(t) if t else None for t in terms])
+    return plans
+
+
+def compile_part1_plan(caption, templates):
+    """Plan for rating one Part 1 caption: six sliders on its first two tone and style traits."""
+    control_scores = caption.get("control_scores", {})
+    tone_traits = list(control_scores.get("tone", {}).keys())[:2]
+    style_traits = list(control_scores.get("writing_style", {}).keys())[:2]
+    application_text = caption.get("application", "the intended application")
+    style_text, style_options, style_terms = _style_question(templates, style_traits)
+    texts = {
+        "tone_relevance": _template_text(templates, "tone_relevance").format(format_traits(tone_traits, TONE_COLOR)),
+        "style_relevance": style_text,
+        "overall_relevance": OVERALL_RELEVANCE_TEXT,
+        "factual_consistency": _template_text(templates, "factual_consistency"),
+        "usefulness": _template_text(templates, "usefulness").format(f"<b class='highlight-trait'>{application_text}</b>"),
+        "human_likeness": _template_text(templates, "human_likeness"),
+    }
+    options = dict(LIKERT_OPTIONS, style_relevance=style_options)
+    questions = [_slider_question(qid, qid, i, texts[qid], options[qid]) for i, qid in enumerate(PART1_QUESTION_IDS)]
+    return {"questions": questions, "terms": sorted(set(tone_traits) | {application_text} | set(style_terms))}
+
+
+def compile_part2_plan(change, templates):
+    """Plan for one Part 2 intensity change; "error" is set if questions.json has no template for it."""
+    field_type = list(change['field_to_change'].keys())[0]
+    trait = change['field_to_change'][field_type]
+    plan = {"question_html": None, "question_text": None, "error": None, "terms": [trait]}
+    template_key = PART2_TEMPLATE_KEYS.get(field_type)
+    if template_key is None:
+        plan["error"] = f"Unknown field type for question template: {field_type}"
+    elif template_key not in templates:
+        plan["error"] = f"Question template key '{template_key}' not found in questions.json"
+    else:
+        change_type = change['change_type']
+        change_class = "highlight-increase" if change_type == "increased" else "highlight-decrease"
+        question_html = templates[template_key].format(f"<b class='highlight-trait'>{trait}</b>", change_type=f"<b class='{change_class}'>{change_type}</b>")
+        plan["question_html"] = question_html
+        plan["question_text"] = re.sub('<[^<]+?>', '', question_html)
+    return plan
+
+
+def compile_part3_plan(comparison, templates):
+    """Plan for one Part 3 caption: tone, style and factual sliders, using the Part 1 templates."""
+    control_scores = comparison.get("control_scores", {})
+    tone_traits = list(control_scores.get("tone", {}).keys())
+    style_traits = list(control_scores.get("writing_style", {}).keys())
+    style_text, style_options, style_terms = _style_question(templates, style_traits)
+    texts = {
+        "tone_relevance": _template_text(templates, "tone_relevance").format(format_traits(tone_traits, TONE_COLOR)),
+        "style_relevance": style_text,
+        "factual_consistency": _template_text(templates, "factual_consistency"),
+    }
+    options = dict(LIKERT_OPTIONS, style_relevance=style_options)
+    questions = []
+    for i, qid in enumerate(PART3_QUESTION_IDS):
+        base_id = qid[len("part3_"):]
+        questions.append(_slider_question(qid, base_id, i, texts[base_id], options[base_id]))
+    return {"questions": questions, "terms": sorted(set(tone_traits) | set(style_terms))}
+
+
+def compile_render_plans(study, quiz, questions, reference_boxes):
+    """Render plans for every item of study_data.json and quiz_data.json, keyed by part and item."""
+    part1_templates = questions['part1_questions']
+    plans = {
+        "part1": {caption['caption_id']: compile_part1_plan(caption, part1_templates)
+                  for video in study.get('part1_ratings', []) for caption in video['captions']},
+        "part2": {change['change_id']: compile_part2_plan(change, questions.get('part2_questions', {}))
+                  for change in study.get('part2_intensity_change', [])},
+        "part3": {comparison['comparison_id']: compile_part3_plan(comparison, part1_templates)
+                  for comparison in study.get('part3_comparisons', [])},
+    }
+    for part in ("part1", "part2", "part3"):
+        for plan in plans[part].values():
+            plan["reference_html"] = reference_boxes(plan["terms"])
+    plans["quiz"] = compile_quiz_plans(quiz, reference_boxes)
+    return plans
@@ -0,0 +1,233 @@
+# rerun_profiler.py
+"""Opt-in timing of the study app's script reruns, by named section.
+
+Every widget interaction reruns user_study_app.py from the top. With profiling
+enabled (ROADTONES_PROFILE=<trace file>, or path in a [profiling] table of
+.streamlit/secrets.toml) each rerun appends one JSON line to the trace file:
+
+    {"ts": 1760000000.0, "session": "3f2c...", "page": "user_study_main", "step": "part1:6",
+     "ended_by": "rerun", "total_ms": 41.7, "sections": {"style": {"ms": 0.4, "calls": 1}, ...}}
+
+ended_by is "end" when the script ran to the bottom, "rerun" or "stop" for
+st.rerun()/st.stop(). A run that raised, or that Streamlit interrupted (e.g. for a
+newer widget event), is "interrupted": it is written when the session's next run
+starts, timed up to its last section or lap. Laps (page and study part) do not overlap each other, but
+sections such as streamlit_js_eval or save_responses are timed inside them.
+
+    python rerun_profiler.py report profile.jsonl
+
+prints p50/p95 rerun latency per page and step, and per section.
+"""
+import argparse
+import collections
+import contextlib
+import functools
+import json
+import math
+import threading
+import time
+import uuid
+
+_current = threading.local() # Trace of the script run on this thread
+
+
+class RerunTrace:
+    """Section timings of one script run."""
+
+    def __init__(self, profiler, session_id):
+        self._profiler = profiler
+        self.session_id = session_id
+        self.context = {"page": None, "step": None}
+        self.sections = {} # name -> [ms, calls]
+        self.started = time.perf_counter()
+        self.last_mark = self.started # End of the last section, or start of the last lap
+        self._lap = None # (name, start) of the open lap
+        self.finished = False
+
+    def _add(self, name, start, end=None):
+        end = time.perf_counter() if end is None else end
+        entry = self.sections.setdefault(name, [0.0, 0])
+        entry[0] += (end - start) * 1000
+        entry[1] += 1
+        self.last_mark = end
+
+    @contextlib.contextmanager
+    def section(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(name, start)
+
+    def lap(self, name):
+        """Ends the open lap, if any, and starts timing `name` until the next lap or the end of the run."""
+        if self._lap:
+            self._add(*self._lap)
+        self._lap = (name, time.perf_counter())
+        self.last_mark = self._lap[1]
+
+    def set_context(self, **context):
+        """Page and step the run is reported under (the last values set win)."""
+        self.context.update(context)
+
+    def finish(self, ended_by="end", end=None):
+        """Writes the trace; `end` (a perf_counter value) defaults to now."""
+        if self.finished:
+            return
+        self.finished = True
+        end = time.perf_counter() if end is None else end
+        if self._lap:
+            self._add(*self._lap, end=end)
+        self._profiler.write({
+            "ts": round(time.time(), 3), "session": self.session_id, **self.context, "ended_by": ended_by,
+            "total_ms": round((end - self.started) * 1000, 3),
+            "sections": {name: {"ms": round(ms, 3), "calls": calls} for name, (ms, calls) in self.sections.items()},
+        })
+
+
+class _NullTrace:
+    """Stands in for RerunTrace when profiling is off; every call is a no-op."""
+
+    finished = True
+
+    def section(self, name):
+        return contextlib.nullcontext()
+
+    def lap(self, name):
+        pass
+
+    def set_context(self, **context):
+        pass
+
+    def finish(self, ended_by="end", end=None):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class RerunProfiler:
+    """Appends finished rerun traces to a JSON-lines file; shared by all sessions of the process."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._last_trace = {} # session id -> trace of its latest run
+
+    def start(self, session_id):
+        """Starts the trace of the script run on the calling thread.
+
+        The session's previous run is finished first if nothing else did: it raised or
+        was interrupted by Streamlit, so it ends at its last section or lap.
+        """
+        previous = self._last_trace.get(session_id)
+        if previous is not None and not previous.finished:
+            previous.finish(ended_by="interrupted", end=previous.last_mark)
+        trace = RerunTrace(self, session_id)
+        self._last_trace[session_id] = trace
+        _current.trace = trace
+        return trace
+
+    def write(self, record):
+        line = json.dumps(record) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def current_trace():
+    """The trace of the script run on this thread, or a no-op trace."""
+    return getattr(_current, "trace", NULL_TRACE)
+
+
+def profiled(name):
+    """Decorator timing each call of a function as section `name` of the current rerun."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with current_trace().section(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def patch_script_control(st):
+    """Makes st.rerun() and st.stop() finish the current trace before they end the script run.
+
+    This replaces the functions on the streamlit module, i.e. for every session and page of the
+    process, so the app only calls it once profiling is on; a run without a trace is unaffected.
+    """
+    for name in ("rerun", "stop"):
+        original = getattr(st, name)
+        if getattr(original, "_finishes_trace", False):
+            continue
+        def wrapper(*args, _original=original, _name=name, **kwargs):
+            current_trace().finish(ended_by=_name)
+            return _original(*args, **kwargs)
+        wrapper._finishes_trace = True
+        setattr(st, name, functools.wraps(original)(wrapper))
+
+
+def new_session_id():
+    return uuid.uuid4().hex[:12]
+
+
+# --- Report ---
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def load_traces(path):
+    traces = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    traces.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue # A line cut short while the app was writing it
+    return traces
+
+
+def summarize(traces):
+    """({(page, step): [total_ms...]}, {section: [ms per rerun...]}), each list sorted."""
+    by_step = collections.defaultdict(list)
+    by_section = collections.defaultdict(list)
+    for trace in traces:
+        by_step[(trace.get("page"), trace.get("step"))].append(trace["total_ms"])
+        for name, timing in trace.get("sections", {}).items():
+            by_section[name].append(timing["ms"])
+    for values in list(by_step.values()) + list(by_section.values()):
+        values.sort()
+    return by_step, by_section
+
+
+def format_report(traces):
+    by_step, by_section = summarize(traces)
+    lines = [f"{len(traces)} reruns", "", f"{'page':<22} {'step':<12} {'reruns':>7} {'p50 ms':>9} {'p95 ms':>9}"]
+    for (page, step), values in sorted(by_step.items(), key=lambda kv: (str(kv[0][0]), str(kv[0][1]))):
+        lines.append(f"{str(page):<22} {str(step or '-'):<12} {len(values):>7} {percentile(values, 0.5):>9.1f} {percentile(values, 0.95):>9.1f}")
+    lines += ["", f"{'section':<34} {'reruns':>7} {'p50 ms':>9} {'p95 ms':>9}"]
+    for name, values in sorted(by_section.items(), key=lambda kv: -percentile(kv[1], 0.95)):
+        lines.append(f"{name:<34} {len(values):>7} {percentile(values, 0.5):>9.1f} {percentile(values, 0.95):>9.1f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize rerun traces written by the study app.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report = subparsers.add_parser("report", help="p50/p95 rerun latency per page/step and per section")
+    report.add_argument("path", help="Trace file (ROADTONES_PROFILE)")
+    args = parser.parse_args()
+    traces = load_traces(args.path)
+    if not traces:
+        print(f"No traces in {args.path}")
+        return
+    print(format_report(traces))
+
+
+if __name__ == "__main__":
+    main()
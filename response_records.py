@@ -0,0 +1,247 @@
+# response_records.py
+"""Typed response records and the compact binary format of the response log.
+
+A ResponseRecord is what the app hands to the response pipeline. It is turned
+back into the familiar string row (to_row) only when it reaches a storage
+backend, so the sheet layout does not change.
+
+Log segments are a sequence of frames. Every string is written once per
+segment in a string frame and referenced by index afterwards, so the repeated
+question text, email and ids of a submit cost four bytes each:
+
+    string frame:  b'S' | uint32 length | utf-8 bytes | uint32 crc32
+    record frame:  b'R' | fixed-size RECORD_STRUCT payload | uint32 crc32
+"""
+import enum
+import json
+import struct
+import time
+import zlib
+
+RECORD_SCHEMA_VERSION = 1
+
+
+class StudyPhase(enum.IntEnum):
+    QUIZ = 0
+    PART1 = 1
+    PART2 = 2
+    PART3 = 3
+
+    @property
+    def label(self):
+        """The study_phase string stored in the sheet."""
+        return _PHASE_LABELS[self]
+
+    @classmethod
+    def from_label(cls, label):
+        """Returns the phase for a study_phase string, or None if it is not a known phase."""
+        return _PHASES_BY_LABEL.get(label)
+
+
+_PHASE_LABELS = {
+    StudyPhase.QUIZ: 'quiz',
+    StudyPhase.PART1: 'user_study_part1',
+    StudyPhase.PART2: 'user_study_part2',
+    StudyPhase.PART3: 'user_study_part3',
+}
+_PHASES_BY_LABEL = {label: phase for phase, label in _PHASE_LABELS.items()}
+
+
+class ResponseRecord:
+    """One answer to one question, with typed fields."""
+
+    __slots__ = ('email', 'age', 'gender', 'timestamp', 'study_phase', 'video_id', 'sample_id', 'question_id',
+                 'question_text', 'choice', 'choice_code', 'was_correct', 'attempts_taken', 'submission_id', 'extras')
+
+    # Fields stored as string-table references, in RECORD_STRUCT order
+    STRING_FIELDS = ('email', 'gender', 'video_id', 'sample_id', 'question_id', 'question_text', 'choice', 'submission_id')
+
+    def __init__(self, email, age, gender, timestamp, study_phase, video_id, sample_id, question_id, question_text,
+                 choice, choice_code=None, was_correct=None, attempts_taken=None, submission_id=None, extras=None):
+        self.email = email
+        self.age = age # int or None
+        self.gender = gender
+        self.timestamp = timestamp # int, seconds since the epoch
+        self.study_phase = study_phase # StudyPhase or None
+        self.video_id = video_id
+        self.sample_id = sample_id
+        self.question_id = question_id
+        self.question_text = question_text
+        self.choice = choice # The label the participant picked
+        self.choice_code = choice_code # 1-based position of a Likert label, else None
+        self.was_correct = was_correct # bool or None
+        self.attempts_taken = attempts_taken # int or None
+        self.submission_id = submission_id
+        self.extras = extras # dict of any other row fields, or None
+
+    def __eq__(self, other):
+        return isinstance(other, ResponseRecord) and all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+
+    def __repr__(self):
+        return f"ResponseRecord({self.study_phase!r}, {self.sample_id!r}, {self.question_id!r}, {self.choice!r})"
+
+    def to_row(self):
+        """The row dict written by storage backends (same columns and string values as always)."""
+        row = {
+            'email': self.email, 'age': self.age if self.age is not None else '', 'gender': self.gender,
+            'timestamp': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.timestamp)),
+            'study_phase': self.study_phase.label if self.study_phase is not None else 'N/A',
+            'video_id': self.video_id, 'sample_id': self.sample_id,
+            'question_id': self.question_id or 'N/A',
+            'question_text': self.question_text, 'user_choice': self.choice,
+            'was_correct': str(self.was_correct) if self.was_correct is not None else 'N/A',
+            'attempts_taken': self.attempts_taken if self.attempts_taken is not None else 'N/A',
+            'submission_id': self.submission_id or 'N/A',
+        }
+        if self.extras:
+            row.update(self.extras)
+        return row
+
+    @classmethod
+    def from_row(cls, row, codes=None):
+        """Parses a stringly-typed row dict (e.g. from responses_backup.jsonl) into a record."""
+        row = dict(row)
+        email = row.pop('email', None)
+        age = _parse_int(row.pop('age', None))
+        gender = row.pop('gender', None)
+        timestamp_text = row.pop('timestamp', None)
+        try:
+            timestamp = int(time.mktime(time.strptime(timestamp_text, "%Y-%m-%d %H:%M:%S")))
+        except (TypeError, ValueError):
+            timestamp = 0
+            row['timestamp'] = timestamp_text # Keep whatever was there
+        phase_label = row.pop('study_phase', None)
+        study_phase = StudyPhase.from_label(phase_label)
+        if study_phase is None and phase_label not in (None, 'N/A'):
+            row['study_phase'] = phase_label
+        choice = row.pop('user_choice', None)
+        was_correct = {'True': True, 'False': False, True: True, False: False}.get(row.pop('was_correct', None))
+        return cls(
+            email=email, age=age, gender=gender, timestamp=timestamp, study_phase=study_phase,
+            video_id=row.pop('video_id', None), sample_id=row.pop('sample_id', None),
+            question_id=_none_if_na(row.pop('question_id', None)), question_text=row.pop('question_text', None),
+            choice=choice, choice_code=(codes or {}).get(choice), was_correct=was_correct,
+            attempts_taken=_parse_int(row.pop('attempts_taken', None)),
+            submission_id=_none_if_na(row.pop('submission_id', None)), extras=row or None,
+        )
+
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _none_if_na(value):
+    return None if value in (None, 'N/A') else value
+
+
+def build_response_record(email, age, gender, video_id, sample_id, choice, study_phase, question_text,
+                          was_correct=None, question_id=None, submission_id=None, codes=None):
+    """Builds the record for one answer; study_phase is a StudyPhase or its study_phase string."""
+    if not isinstance(study_phase, StudyPhase):
+        study_phase = StudyPhase.from_label(study_phase)
+    choice = str(choice)
+    return ResponseRecord(
+        email=email, age=_parse_int(age), gender=str(gender), timestamp=int(time.time()),
+        study_phase=study_phase, video_id=video_id, sample_id=sample_id, question_id=question_id,
+        question_text=question_text, choice=choice, choice_code=(codes or {}).get(choice),
+        was_correct=was_correct, attempts_taken=1 if study_phase == StudyPhase.QUIZ else None,
+        submission_id=submission_id,
+    )
+
+
+# --- Binary log codec ---
+FRAME_STRING = b'S'
+FRAME_RECORD = b'R'
+# version, seq, timestamp, age, study_phase, choice_code, was_correct, attempts_taken, extras ref, 8 string refs
+RECORD_STRUCT = struct.Struct('<BQqhBbBhI' + 'I' * len(ResponseRecord.STRING_FIELDS))
+_LENGTH = struct.Struct('<I')
+_CRC = struct.Struct('<I')
+_NONE_BYTE = 255
+
+
+class RecordCodec:
+    """Encodes (seq, record) pairs into frames, interning strings in a per-segment table."""
+
+    def __init__(self):
+        self.valid_bytes = 0
+        self.reset()
+
+    def reset(self):
+        """Starts a new string table (called for every new segment)."""
+        self._refs = {} # string -> 1-based index; 0 means None
+        self._strings = [None]
+
+    def _ref(self, value, out):
+        if value is None:
+            return 0
+        ref = self._refs.get(value)
+        if ref is None:
+            data = value.encode('utf-8')
+            frame = FRAME_STRING + _LENGTH.pack(len(data)) + data
+            out.append(frame + _CRC.pack(zlib.crc32(frame)))
+            ref = self._refs[value] = len(self._strings)
+            self._strings.append(value)
+        return ref
+
+    def encode(self, entries):
+        """Returns the bytes for a list of (seq, ResponseRecord)."""
+        out = []
+        for seq, record in entries:
+            refs = [self._ref(None if v is None else str(v), out) for v in (getattr(record, f) for f in ResponseRecord.STRING_FIELDS)]
+            extras_ref = self._ref(json.dumps(record.extras, sort_keys=True) if record.extras else None, out)
+            was_correct = 0 if record.was_correct is None else (2 if record.was_correct else 1)
+            frame = FRAME_RECORD + RECORD_STRUCT.pack(
+                RECORD_SCHEMA_VERSION, seq, record.timestamp,
+                -1 if record.age is None else record.age,
+                _NONE_BYTE if record.study_phase is None else int(record.study_phase),
+                -1 if record.choice_code is None else record.choice_code,
+                was_correct,
+                -1 if record.attempts_taken is None else record.attempts_taken,
+                extras_ref, *refs)
+            out.append(frame + _CRC.pack(zlib.crc32(frame)))
+        return b''.join(out)
+
+    def decode(self, data):
+        """Yields (seq, ResponseRecord) from a whole segment, rebuilding its string table.
+
+        Stops at the first torn or corrupt frame: that append never returned to its caller.
+        """
+        self.reset()
+        strings = self._strings
+        pos, end = 0, len(data)
+        self.valid_bytes = 0 # Length of the intact prefix decoded so far
+        while pos < end:
+            tag = data[pos:pos + 1]
+            if tag == FRAME_STRING:
+                if pos + 5 > end:
+                    return
+                (length,) = _LENGTH.unpack_from(data, pos + 1)
+                body_end = pos + 5 + length
+                if body_end + 4 > end or _CRC.unpack_from(data, body_end)[0] != zlib.crc32(data[pos:body_end]):
+                    return
+                value = data[pos + 5:body_end].decode('utf-8')
+                self._refs[value] = len(strings)
+                strings.append(value)
+                pos = self.valid_bytes = body_end + 4
+            elif tag == FRAME_RECORD:
+                body_end = pos + 1 + RECORD_STRUCT.size
+                if body_end + 4 > end or _CRC.unpack_from(data, body_end)[0] != zlib.crc32(data[pos:body_end]):
+                    return
+                (version, seq, timestamp, age, phase, choice_code, was_correct, attempts, extras_ref,
+                 *refs) = RECORD_STRUCT.unpack_from(data, pos + 1)
+                if version != RECORD_SCHEMA_VERSION:
+                    raise ValueError(f"Unsupported response record version {version}")
+                values = dict(zip(ResponseRecord.STRING_FIELDS, (strings[r] for r in refs)))
+                yield seq, ResponseRecord(
+                    timestamp=timestamp, age=None if age < 0 else age,
+                    study_phase=None if phase == _NONE_BYTE else StudyPhase(phase),
+                    choice_code=None if choice_code < 0 else choice_code,
+                    was_correct=None if was_correct == 0 else was_correct == 2,
+                    attempts_taken=None if attempts < 0 else attempts,
+                    extras=json.loads(strings[extras_ref]) if extras_ref else None, **values)
+                pos = self.valid_bytes = body_end + 4
+            else:
+                return
@@ -0,0 +1,685 @@
+# response_store.py
+"""Response persistence for the user study app.
+
+Every submitted answer goes to a local write-ahead log first. A background
+replayer drains the log to a storage backend (Google Sheets, SQLite or JSONL)
+in batches, so a participant never waits on the network and an outage never
+loses a response.
+"""
+import abc
+import collections
+import contextlib
+import glob
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import gspread
+from google.auth.transport.requests import Request
+
+from response_records import RecordCodec, ResponseRecord, build_response_record
+from rerun_profiler import profiled
+
+logger = logging.getLogger(__name__)
+
+
+# --- Likert scales ---
+# Slider options per Part 1 question id, lowest to highest. Part 3 uses the same scales
+# under "part3_<id>"; style_relevance may be overridden per trait in questions.json.
+LIKERT_OPTIONS = {
+    "tone_relevance": ["Not at all", "Weak", "Moderate", "Strong", "Very Strong"],
+    "style_relevance": ["Not at all", "Weak", "Moderate", "Strong", "Very Strong"],
+    "overall_relevance": ["Not at all", "Weak", "Moderate", "Strong", "Very Strong"],
+    "factual_consistency": ["Contradicts", "Inaccurate", "Partially", "Mostly Accurate", "Accurate"],
+    "usefulness": ["Not at all", "Slightly", "Moderately", "Very", "Extremely"],
+    "human_likeness": ["Robotic", "Unnatural", "Moderate", "Very Human-like", "Natural"],
+}
+
+
+def likert_scales(questions=None):
+    """All option lists in use: LIKERT_OPTIONS plus style overrides from questions.json data."""
+    scales = [list(options) for options in LIKERT_OPTIONS.values()]
+    for q in (questions or {}).get('part1_questions', []):
+        if q.get('default_options'):
+            scales.append(list(q['default_options']))
+        scales.extend(list(o['options']) for o in q.get('overrides', {}).values() if o.get('options'))
+    return scales
+
+
+def likert_code_map(questions=None):
+    """Maps a choice label to its 1-based position on its scale; labels at conflicting positions are left out."""
+    codes, conflicts = {}, set()
+    for options in likert_scales(questions):
+        for position, label in enumerate(options, start=1):
+            if codes.get(label, position) != position:
+                conflicts.add(label)
+            codes[label] = position
+    return {label: code for label, code in codes.items() if label not in conflicts}
+
+
+# --- Header / schema management ---
+class SheetSchema:
+    """Remembers a worksheet's header row so it is read once per process instead of once per write."""
+
+    def __init__(self):
+        self._columns = {} # worksheet key -> column order of the header row
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(worksheet):
+        return (getattr(worksheet, "spreadsheet_id", None), getattr(worksheet, "id", id(worksheet)))
+
+    def columns_for(self, worksheet, fields):
+        """Returns the header column order, creating or extending the header row if needed."""
+        key = self._key(worksheet)
+        with self._lock:
+            columns = self._columns.get(key)
+            if columns is None:
+                # Blank header cells stay in place (as '') so later fields keep their column
+                columns = worksheet.row_values(1)
+                if not any(columns):
+                    columns = list(fields)
+                    worksheet.append_row(columns)
+            missing = [f for f in fields if f not in columns]
+            if missing:
+                # Schema drift: response_dict gained fields the sheet has never seen
+                logger.warning("Response fields %s are not in the sheet header; extending it.", missing)
+                columns = columns + missing
+                worksheet.update(values=[columns], range_name='A1')
+            self._columns[key] = columns
+            return columns
+
+    def invalidate(self, worksheet=None):
+        """Forgets the cached header so the next write re-reads it (called after a write error)."""
+        with self._lock:
+            if worksheet is None:
+                self._columns.clear()
+            else:
+                self._columns.pop(self._key(worksheet), None)
+
+
+# --- Google Sheets client ---
+class _SheetsConnection:
+    """The authorized gspread client (with its HTTP session) and its worksheet."""
+
+    def __init__(self, worksheet, credentials):
+        self.worksheet = worksheet
+        self.credentials = credentials
+        self.last_checked = time.monotonic()
+
+
+class SheetsClient:
+    """One authorized worksheet, reused for every write.
+
+    Only the ResponseWriter's replay thread writes to the sheet, so a single client is
+    enough; the lock just keeps an occasional caller on another thread from sharing it
+    mid-request. The connection is opened lazily, so a failed connect is never cached:
+    the next use simply tries again (after a short backoff so an auth outage is not hammered).
+    """
+
+    def __init__(self, connect, health_check_interval=300.0, reconnect_backoff=5.0, reconnect_backoff_max=120.0):
+        self.connect = connect # Callable returning (worksheet, credentials); raises on failure
+        self.health_check_interval = health_check_interval
+        self.reconnect_backoff = reconnect_backoff
+        self.reconnect_backoff_max = reconnect_backoff_max
+        self._connection = None
+        self._lock = threading.Lock()
+        self._connect_failures = 0
+        self._next_connect_at = 0.0
+
+    @contextlib.contextmanager
+    def worksheet(self):
+        """Yields a healthy worksheet; the client is dropped if it breaks while in use."""
+        with self._lock:
+            connection = self._healthy_connection()
+            try:
+                yield connection.worksheet
+            except Exception as e:
+                if self._is_client_error(e):
+                    self._connection = None
+                raise
+
+    @staticmethod
+    def _is_client_error(e):
+        # Quota (429) and server (5xx) errors say nothing about our session; anything else might
+        if isinstance(e, gspread.exceptions.APIError):
+            return e.code in (401, 403) or e.code < 0
+        return True
+
+    def _healthy_connection(self):
+        if self._connection is None:
+            self._connection = self._connect()
+        try:
+            self._check_health(self._connection)
+        except Exception:
+            self._connection = None
+            raise
+        return self._connection
+
+    def _connect(self):
+        now = time.monotonic()
+        if now < self._next_connect_at:
+            raise ConnectionError(f"Not reconnecting to Google Sheets for another {self._next_connect_at - now:.0f}s")
+        try:
+            worksheet, credentials = self.connect()
+        except Exception as e:
+            self._connect_failures += 1
+            delay = min(self.reconnect_backoff_max, self.reconnect_backoff * 2 ** (self._connect_failures - 1))
+            self._next_connect_at = time.monotonic() + delay
+            logger.warning("Could not connect to Google Sheets (failure %d): %s", self._connect_failures, e)
+            raise ConnectionError(f"Failed to connect to Google Sheets: {e}") from e
+        self._connect_failures = 0
+        return _SheetsConnection(worksheet, credentials)
+
+    def _check_health(self, connection):
+        credentials = connection.credentials
+        # Refresh the access token once google-auth considers it expired (its expiry check
+        # already allows for clock skew) instead of eating a 401 mid-write
+        if credentials is not None and not credentials.valid:
+            credentials.refresh(Request())
+        if time.monotonic() - connection.last_checked > self.health_check_interval:
+            connection.worksheet.spreadsheet.fetch_sheet_metadata()
+        connection.last_checked = time.monotonic()
+
+
+# --- Write-ahead log ---
+class WriteAheadLog:
+    """Append-only, fsync'd segments of response records, each tagged with a sequence number.
+
+    Segments are written in the binary format of response_records.RecordCodec; JSONL
+    segments left by older versions of the app are still read and replayed.
+    """
+
+    SEGMENT_PATTERNS = ("wal-*.bin", "wal-*.jsonl")
+
+    def __init__(self, directory, segment_max_bytes=1024 * 1024):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.checkpoint_path = os.path.join(directory, "checkpoint")
+        self._lock = threading.Lock()
+        self._codec = RecordCodec() # String table of the segment currently appended to
+        self._codec_segment = None
+        os.makedirs(directory, exist_ok=True)
+        self.last_seq = self._scan_last_seq()
+
+    def _segments(self):
+        paths = [p for pattern in self.SEGMENT_PATTERNS for p in glob.glob(os.path.join(self.directory, pattern))]
+        return sorted(paths, key=self._first_seq)
+
+    @staticmethod
+    def _first_seq(segment_path):
+        return int(os.path.splitext(os.path.basename(segment_path))[0][len("wal-"):])
+
+    @staticmethod
+    def _read_segment(segment_path, codec=None):
+        """Yields (seq, ResponseRecord) for every intact entry of a segment."""
+        if segment_path.endswith(".jsonl"):
+            with open(segment_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue # Torn write from a crash; that append never returned
+                    yield entry["seq"], ResponseRecord.from_row(entry["row"])
+            return
+        with open(segment_path, "rb") as f:
+            data = f.read()
+        yield from (codec or RecordCodec()).decode(data)
+
+    def _scan_last_seq(self):
+        segments = self._segments()
+        if not segments:
+            return self.read_checkpoint()
+        last = segments[-1]
+        last_seq = self._first_seq(last) - 1
+        for seq, _ in self._read_segment(last, self._codec):
+            last_seq = max(last_seq, seq)
+        if last.endswith(".bin"):
+            # Resume appending to the last segment with its string table; drop a torn tail first
+            if os.path.getsize(last) > self._codec.valid_bytes:
+                logger.warning("Truncating a partially written entry at the end of %s.", last)
+                with open(last, "r+b") as f:
+                    f.truncate(self._codec.valid_bytes)
+            self._codec_segment = last
+        return max(last_seq, self.read_checkpoint())
+
+    def append(self, records):
+        """Writes records to the log and fsyncs. Returns the sequence number of the last record."""
+        with self._lock:
+            if not records:
+                return self.last_seq
+            segment = self._codec_segment
+            if segment is None or os.path.getsize(segment) >= self.segment_max_bytes:
+                segment = os.path.join(self.directory, f"wal-{self.last_seq + 1:012d}.bin")
+                self._codec.reset()
+                self._codec_segment = segment
+            # Sequence numbers are only taken once the entries are on disk, so a failed write
+            # leaves no gap that flush() would wait for
+            entries = [(self.last_seq + i, record) for i, record in enumerate(records, start=1)]
+            size_before = os.path.getsize(segment) if os.path.exists(segment) else 0
+            try:
+                with open(segment, "ab") as f:
+                    f.write(self._codec.encode(entries))
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception:
+                # The string table may now name strings that never reached the disk
+                self._codec_segment = None
+                self._truncate(segment, size_before)
+                raise
+            self.last_seq = entries[-1][0]
+            return self.last_seq
+
+    @staticmethod
+    def _truncate(segment, size):
+        """Drops whatever part of a failed append reached the segment, so its sequence numbers can be reused."""
+        try:
+            with open(segment, "r+b") as f:
+                f.truncate(size)
+        except OSError as e:
+            logger.error("Could not roll back a failed append to %s: %s", segment, e)
+
+    def read_after(self, seq, limit):
+        """Returns up to `limit` (seq, ResponseRecord) log entries with a sequence number greater than `seq`."""
+        entries = []
+        segments = self._segments()
+        for i, segment in enumerate(segments):
+            if i + 1 < len(segments) and self._first_seq(segments[i + 1]) <= seq + 1:
+                continue # Every entry in this segment is at or before `seq`
+            for entry in self._read_segment(segment):
+                if entry[0] > seq:
+                    entries.append(entry)
+                    if len(entries) >= limit:
+                        return entries
+        return entries
+
+    def read_checkpoint(self):
+        """Sequence number of the last record known to be in the backend."""
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def write_checkpoint(self, seq):
+        """Records progress and deletes segments that have been fully replayed."""
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(seq))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        with self._lock:
+            segments = self._segments()
+            for current, following in zip(segments, segments[1:]):
+                if self._first_seq(following) - 1 <= seq:
+                    os.remove(current)
+
+
+def dedup_key(row):
+    """Identity of a response row; replaying the same row twice must not write it twice.
+
+    Rows carrying a submission token are identified by (token, question_id), so a
+    re-sent submit is recognised even though its timestamp differs.
+    """
+    submission_id = row.get('submission_id')
+    if submission_id and submission_id != 'N/A':
+        return ('submission', str(submission_id), str(row.get('question_id', '')))
+    return tuple(str(row.get(k, '')) for k in ('email', 'sample_id', 'question_text', 'timestamp'))
+
+
+# --- Storage backends ---
+class StorageBackend(abc.ABC):
+    """Destination for replayed response rows."""
+
+    name = "base"
+
+    @abc.abstractmethod
+    def write_rows(self, rows):
+        """Persists a batch of row dicts. Raises on failure so the batch is retried."""
+
+    @abc.abstractmethod
+    def existing_keys(self):
+        """dedup_key() of every row already stored, used after an unclean shutdown."""
+
+
+class SheetsBackend(StorageBackend):
+    """Appends rows to the Google Sheet through a SheetsClient."""
+
+    name = "gsheets"
+
+    def __init__(self, client, schema=None):
+        self.client = client
+        self.schema = schema or SheetSchema()
+
+    def write_rows(self, rows):
+        with self.client.worksheet() as worksheet:
+            try:
+                fields = list(dict.fromkeys(col for row in rows for col in row))
+                header = self.schema.columns_for(worksheet, fields)
+                worksheet.append_rows([[row.get(col, '') for col in header] for row in rows])
+            except Exception:
+                self.schema.invalidate(worksheet)
+                raise
+
+    def existing_keys(self):
+        with self.client.worksheet() as worksheet:
+            records = worksheet.get_all_records(numericise_ignore=['all'])
+        return {dedup_key(r) for r in records}
+
+
+class SQLiteBackend(StorageBackend):
+    """Stores rows in a local SQLite database (WAL mode), one connection per thread."""
+
+    name = "sqlite"
+    BASE_COLUMNS = ['email', 'age', 'gender', 'timestamp', 'study_phase', 'video_id', 'sample_id',
+                    'question_id', 'question_text', 'user_choice', 'was_correct', 'attempts_taken', 'submission_id']
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        columns = ", ".join(f'"{c}"' for c in self.BASE_COLUMNS)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS responses (id INTEGER PRIMARY KEY, {columns})")
+        self._columns = self._table_columns(conn)
+        self._ensure_columns(conn, self.BASE_COLUMNS) # Databases created before a column was added
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_email ON responses (email)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_study_phase ON responses (study_phase)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_sample_id ON responses (sample_id)")
+        # Same identities as dedup_key(), so a replayed row is ignored rather than duplicated
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_responses_dedup ON responses (email, sample_id, question_text, timestamp)")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_responses_submission ON responses (submission_id, question_id) WHERE submission_id != 'N/A'")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL") # Safe with WAL; the response log is the durable copy
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _table_columns(conn):
+        return [r[1] for r in conn.execute("PRAGMA table_info(responses)") if r[1] != 'id']
+
+    def _ensure_columns(self, conn, fields):
+        missing = [f for f in fields if f not in self._columns]
+        if not missing:
+            return
+        with self._schema_lock:
+            self._columns = self._table_columns(conn)
+            for field in missing:
+                if field in self._columns:
+                    continue
+                if '"' in field:
+                    raise ValueError(f"Invalid response field name: {field!r}")
+                logger.warning("Adding column %r to the responses table.", field)
+                conn.execute(f'ALTER TABLE responses ADD COLUMN "{field}"')
+                self._columns.append(field)
+            conn.commit()
+
+    def write_rows(self, rows):
+        conn = self._conn()
+        fields = list(dict.fromkeys(col for row in rows for col in row))
+        self._ensure_columns(conn, fields)
+        columns = ", ".join(f'"{c}"' for c in fields)
+        placeholders = ", ".join("?" for _ in fields)
+        with conn:
+            conn.executemany(f"INSERT OR IGNORE INTO responses ({columns}) VALUES ({placeholders})",
+                             [[row.get(col) for col in fields] for row in rows])
+
+    def existing_keys(self):
+        conn = self._conn()
+        conn.row_factory = sqlite3.Row
+        try:
+            cursor = conn.execute("SELECT email, sample_id, question_text, timestamp, submission_id, question_id FROM responses")
+            return {dedup_key({k: '' if r[k] is None else r[k] for k in r.keys()}) for r in cursor}
+        finally:
+            conn.row_factory = None
+
+
+class JsonlBackend(StorageBackend):
+    """Appends rows to a local JSONL file."""
+
+    name = "jsonl"
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write_rows(self, rows):
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(row) + "\n" for row in rows))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def existing_keys(self):
+        if not os.path.exists(self.path):
+            return set()
+        keys = set()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    keys.add(dedup_key(json.loads(line)))
+                except ValueError:
+                    continue
+        return keys
+
+
+def create_backend(kind, client=None, schema=None, path=None):
+    """Builds the storage backend named in the app config ('gsheets', 'sqlite' or 'jsonl')."""
+    if kind == "sqlite":
+        return SQLiteBackend(path or "responses.sqlite3")
+    if kind == "jsonl":
+        return JsonlBackend(path or "responses.jsonl")
+    if kind == "gsheets":
+        return SheetsBackend(client, schema)
+    raise ValueError(f"Unknown storage backend: {kind!r}")
+
+
+# --- Per-caption aggregates ---
+class AggregateIndex:
+    """Running count, sum and sum of squares of Likert codes per (sample_id, question_id).
+
+    Updated by the replayer for every stored row; persisted to SQLite and mirrored in a
+    dict so lookups from the admin view are O(1).
+    """
+
+    def __init__(self, path, codes):
+        self.path = path
+        self.codes = codes # Choice label -> number, e.g. from likert_code_map()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS aggregates (
+            sample_id TEXT NOT NULL, question_id TEXT NOT NULL,
+            n INTEGER NOT NULL, total REAL NOT NULL, total_sq REAL NOT NULL,
+            PRIMARY KEY (sample_id, question_id))""")
+        self._conn.commit()
+        self._stats = {(r[0], r[1]): [r[2], r[3], r[4]]
+                       for r in self._conn.execute("SELECT sample_id, question_id, n, total, total_sq FROM aggregates")}
+
+    def update(self, rows):
+        """Adds stored response rows; rows without a question id or a Likert answer are skipped."""
+        deltas = {}
+        for row in rows:
+            value = self.codes.get(row.get('user_choice'))
+            question_id = row.get('question_id')
+            if value is None or not question_id or question_id == 'N/A' or row.get('study_phase') == 'quiz':
+                continue
+            delta = deltas.setdefault((str(row.get('sample_id')), question_id), [0, 0.0, 0.0])
+            delta[0] += 1
+            delta[1] += value
+            delta[2] += value * value
+        if not deltas:
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    """INSERT INTO aggregates (sample_id, question_id, n, total, total_sq) VALUES (?, ?, ?, ?, ?)
+                       ON CONFLICT (sample_id, question_id) DO UPDATE SET
+                       n = n + excluded.n, total = total + excluded.total, total_sq = total_sq + excluded.total_sq""",
+                    [(k[0], k[1], d[0], d[1], d[2]) for k, d in deltas.items()])
+            for key, delta in deltas.items():
+                stats = self._stats.setdefault(key, [0, 0.0, 0.0])
+                for i in range(3):
+                    stats[i] += delta[i]
+
+    @staticmethod
+    def _summarize(stats):
+        n, total, total_sq = stats
+        mean = total / n
+        variance = (total_sq - n * mean * mean) / (n - 1) if n > 1 else 0.0
+        return {'count': n, 'mean': mean, 'variance': max(variance, 0.0)}
+
+    def get(self, sample_id, question_id):
+        """Returns {'count', 'mean', 'variance'} for one caption/comparison question, or None."""
+        with self._lock:
+            stats = list(self._stats.get((str(sample_id), question_id), ()))
+        return self._summarize(stats) if stats and stats[0] else None
+
+    def snapshot(self):
+        """All aggregates as a list of dicts, for display."""
+        with self._lock:
+            stats_by_key = {key: list(stats) for key, stats in self._stats.items()}
+        return [dict(sample_id=key[0], question_id=key[1], **self._summarize(stats))
+                for key, stats in sorted(stats_by_key.items()) if stats[0]]
+
+
+# --- Background replay ---
+class ResponseWriter:
+    """Logs response records locally and replays them as rows to a storage backend from a background thread."""
+
+    def __init__(self, wal_dir, backend, on_write=(), max_batch_rows=500,
+                 backoff_base=1.0, backoff_max=300.0, idle_poll=5.0, recent_keys_max=50000):
+        self.wal = WriteAheadLog(wal_dir)
+        self.backend = backend
+        self.on_write = list(on_write) # Callables given each batch of newly stored rows
+        self.max_batch_rows = max_batch_rows
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.idle_poll = idle_poll
+        self.checkpoint = self.wal.read_checkpoint()
+        # Keys of the most recently written rows, enough to drop a re-sent submit; older
+        # duplicates are left to the backend (SQLite has unique indexes on the same keys)
+        self.recent_keys_max = recent_keys_max
+        self._recent_keys = collections.OrderedDict()
+        # Rows after the checkpoint may have been stored just before a crash; the backend's
+        # keys are loaded for them and dropped once the replay has caught up with the log
+        self._recovery_keys = None
+        self._recovery_until = self.wal.last_seq if self.wal.last_seq > self.checkpoint else None
+        self._wakeup = threading.Event()
+        self._progress = threading.Condition()
+        self._worker = threading.Thread(target=self._run, name="response-replayer", daemon=True)
+        self._worker.start()
+
+    def submit(self, records):
+        """Durably logs one batch of ResponseRecords (or row dicts). Returns True once it is fsync'd to disk."""
+        if not records:
+            return True
+        try:
+            self.wal.append([r if isinstance(r, ResponseRecord) else ResponseRecord.from_row(r) for r in records])
+        except OSError as e:
+            logger.error("Could not append to the response log: %s", e)
+            return False
+        self._wakeup.set()
+        return True
+
+    def import_jsonl(self, path):
+        """Moves rows from a plain JSONL backup file (e.g. responses_backup.jsonl) into the log."""
+        if not os.path.exists(path):
+            return 0
+        with open(path, "r", encoding="utf-8") as f:
+            rows = []
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    continue
+        if rows and not self.submit(rows):
+            return 0
+        os.replace(path, path + ".imported")
+        return len(rows)
+
+    def flush(self, timeout=None):
+        """Blocks until every logged row has been replayed. Returns False on timeout."""
+        target = self.wal.last_seq
+        with self._progress:
+            return self._progress.wait_for(lambda: self.checkpoint >= target, timeout)
+
+    def _run(self):
+        attempt = 0
+        while True:
+            entries = self.wal.read_after(self.checkpoint, self.max_batch_rows)
+            if not entries:
+                self._wakeup.wait(self.idle_poll)
+                self._wakeup.clear()
+                continue
+            try:
+                self._replay([record.to_row() for _, record in entries])
+            except Exception as e:
+                attempt += 1
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+                delay *= random.uniform(0.5, 1.0) # Jitter so restarted processes do not retry in lockstep
+                if isinstance(e, gspread.exceptions.APIError):
+                    logger.warning("Sheets API error during replay (attempt %d), retrying in %.1fs: %s", attempt, delay, e)
+                else:
+                    logger.warning("Replay to %s failed (attempt %d), retrying in %.1fs: %s", self.backend.name, attempt, delay, e)
+                time.sleep(delay)
+                continue
+            attempt = 0
+            self.wal.write_checkpoint(entries[-1][0])
+            with self._progress:
+                self.checkpoint = entries[-1][0]
+                self._progress.notify_all()
+            if self._recovery_until is not None and self.checkpoint >= self._recovery_until:
+                self._recovery_keys = self._recovery_until = None
+
+    def _replay(self, rows):
+        if self._recovery_until is not None and self._recovery_keys is None:
+            self._recovery_keys = self.backend.existing_keys()
+        fresh, fresh_keys = [], []
+        for row in rows:
+            key = dedup_key(row)
+            if key in self._recent_keys or (self._recovery_keys and key in self._recovery_keys):
+                continue
+            self._recent_keys[key] = None
+            fresh.append(row)
+            fresh_keys.append(key)
+        if not fresh:
+            return
+        try:
+            self.backend.write_rows(fresh)
+        except Exception:
+            for key in fresh_keys:
+                self._recent_keys.pop(key, None)
+            raise
+        while len(self._recent_keys) > self.recent_keys_max:
+            self._recent_keys.popitem(last=False)
+        for listener in self.on_write:
+            try:
+                listener(fresh)
+            except Exception as e: # Rows are stored; a failing listener must not cause a re-write
+                logger.error("Response listener %r failed: %s", listener, e)
+
+
+# --- Submitting ---
+@profiled("save_responses")
+def queue_responses(writer, codes, email, age, gender, video_data, caption_data, answers, study_phase, was_correct=None, submission_id=None):
+    """Logs all (question_id, question_text, choice) answers from one submit as a single batch.
+
+    Returns the records that could not be logged (none on success), for the caller to back up.
+    """
+    video_id = video_data.get('video_id', 'N/A')
+    sample_id = caption_data.get('caption_id') or caption_data.get('comparison_id') or caption_data.get('change_id') or caption_data.get('sample_id')
+    records = [build_response_record(email, age, gender, video_id, sample_id, choice, study_phase, question_text, was_correct, question_id, submission_id, codes)
+               for question_id, question_text, choice in answers]
+    return [] if writer.submit(records) else records
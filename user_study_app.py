@@ -5,22 +5,57 @@ import os
 import time
 import re
 import json
-import cv2
-import math
+import logging
 import gspread
 import random
+import uuid
+import html
+import functools
+import itertools
+import urllib.parse
+from streamlit import runtime
 from google.oauth2.service_account import Credentials
 from streamlit_js_eval import streamlit_js_eval
+from media_index import MediaIndex, build_media_registry, describe_videos
+from media_server import start_in_background
+from question_plans import PART1_QUESTION_IDS, PART2_FACTUAL_QUESTION, PART3_QUESTION_IDS, ReferenceBoxes, compile_render_plans
+from response_records import StudyPhase
+from rerun_profiler import NULL_TRACE, RerunProfiler, current_trace, new_session_id, patch_script_control, profiled
+from response_store import AggregateIndex, ResponseWriter, SheetSchema, SheetsClient, create_backend, likert_code_map, queue_responses
 # import traceback # No longer needed for standard operation
 
+logger = logging.getLogger(__name__)
+streamlit_js_eval = profiled("streamlit_js_eval")(streamlit_js_eval) # A no-op wrapper unless profiling is on
+
 # --- Configuration ---
 INTRO_VIDEO_PATH = "media/start_video_slower.mp4"
+INSTRUCTIONS_VIDEO_PATH = "media/intro_to_tone.mp4"
 STUDY_DATA_PATH = "study_data.json"
 QUIZ_DATA_PATH = "quiz_data.json"
 INSTRUCTIONS_PATH = "instructions.json"
 QUESTIONS_DATA_PATH = "questions.json"
 DEFINITIONS_PATH = "definitions.json"
+MEDIA_INDEX_PATH = "media_index.json" # Built offline with `python media_index.py build`
+MEDIA_DIR = "media"
+STUDY_PART_KEYS = ["part1_ratings", "part2_intensity_change", "part3_comparisons"] # study_data.json lists, in study order
+MEDIA_URL_HASH_LENGTH = 16 # Hex digits of the sha256 in versioned media URLs
+# Smallest rendition (`python media_index.py transcode`, opt-in: none ship, so the source clips play
+# until it has been run) that still looks sharp in the player, by orientation.
+# Landscape clips fill the left video column (~440 px wide, ~250 px tall on a 1440 px screen), portrait
+# clips the middle 3/5 of it (~260 px wide). 360 px leaves headroom for high-DPI screens and sits below
+# every landscape source (448 px and up); the 252 px portrait sources are already smaller and play as is.
+RENDITION_MIN_SHORT_SIDE = {"landscape": 360, "portrait": 360}
+# By default st.video reads and serves the clips itself. To stream them from a media server, set
+# ROADTONES_MEDIA_URL or a [media] table in .streamlit/secrets.toml (base_url, serve_port); see media_server.py.
 LOCAL_BACKUP_FILE = "responses_backup.jsonl"
+RESPONSE_WAL_DIR = "responses_wal" # Write-ahead log replayed to the storage backend in the background
+# Storage backend: "gsheets", "sqlite" or "jsonl". Override with a [storage] table in
+# .streamlit/secrets.toml or ROADTONES_STORAGE_BACKEND / ROADTONES_STORAGE_PATH env vars.
+STORAGE_BACKEND = "gsheets"
+STORAGE_PATHS = {"sqlite": "responses.sqlite3", "jsonl": "responses.jsonl"}
+AGGREGATES_DB_PATH = "responses_aggregates.sqlite3" # Running per-caption rating statistics
+# Rerun profiling is off unless ROADTONES_PROFILE (or path in a [profiling] table of secrets.toml)
+# names a trace file; summarize it with `python rerun_profiler.py report <file>`.
 
 # --- JAVASCRIPT FOR ANIMATION ---
 JS_ANIMATION_RESET = """
@@ -52,27 +87,55 @@ JS_ANIMATION_RESET = """
     });
 """
 
+# --- JAVASCRIPT FOR VIDEO PLAYBACK GATING ---
+# Resolves once the clip on the page has played to the end. A video only counts after it has been seen
+# playing, so the previous item's finished player cannot end the wait early. __TIMEOUT_MS__ is a safety
+# net for players that never report the end (e.g. autoplay blocked and nobody presses play).
+JS_WAIT_FOR_VIDEO_END = """
+new Promise((resolve) => {
+    const started = Date.now();
+    let seenPlaying = false;
+    const poll = setInterval(() => {
+        const videos = Array.from(window.parent.document.querySelectorAll('video')).filter(v => v.style.display !== 'none');
+        const video = videos[videos.length - 1];
+        if (video && !video.paused && !video.ended) seenPlaying = true;
+        if (seenPlaying && video && (video.ended || (video.duration && video.currentTime >= video.duration - 0.25))) {
+            clearInterval(poll);
+            resolve('ended');
+        } else if (Date.now() - started > __TIMEOUT_MS__) {
+            clearInterval(poll);
+            resolve('timeout');
+        }
+    }, 250);
+})
+"""
+VIDEO_END_TIMEOUT_FACTOR = 3 # Give up waiting for the end after this many clip durations
+
 # --- GOOGLE SHEETS & HELPERS ---
-@st.cache_resource # Re-enabled caching
 def connect_to_gsheet():
-    """Connects to the Google Sheet using Streamlit secrets."""
-    try:
-        creds = Credentials.from_service_account_info(
-            st.secrets["gcp_service_account"],
-            scopes=["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"],
-        )
-        client = gspread.authorize(creds)
-        # --- Make sure this matches your sheet name ---
-        spreadsheet = client.open("roadtones-streamlit-userstudy-responses") 
-        return spreadsheet.sheet1
-    except Exception as e:
-        # Keep error for connection failure, but no traceback for user
-        st.error(f"Failed to connect to Google Sheets: {e}")
-        return None
+    """Authorizes a new gspread client from Streamlit secrets and opens the responses worksheet."""
+    creds = Credentials.from_service_account_info(
+        st.secrets["gcp_service_account"],
+        scopes=["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"],
+    )
+    client = gspread.authorize(creds)
+    # --- Make sure this matches your sheet name ---
+    spreadsheet = client.open("roadtones-streamlit-userstudy-responses")
+    return spreadsheet.sheet1, creds
+
+@st.cache_resource
+def get_gsheet_client():
+    """gspread client shared by all sessions (only the response writer uses it); connects lazily and reconnects on failure."""
+    return SheetsClient(connect_to_gsheet)
+
+@st.cache_resource
+def get_sheet_schema():
+    """Header row of the responses worksheet, checked once per process."""
+    return SheetSchema()
 
 
 def save_response_locally(response_dict):
-    """Saves a response dictionary to a local JSONL file as a fallback."""
+    """Saves a response dictionary to a local JSONL file as a fallback; it is replayed on the next start."""
     try:
         with open(LOCAL_BACKUP_FILE, "a") as f:
             f.write(json.dumps(response_dict) + "\n")
@@ -81,73 +144,239 @@ def save_response_locally(response_dict):
         st.error(f"Critical Error: Could not save response to local backup file. {e}")
         return False
 
-def save_response(email, age, gender, video_data, caption_data, choice, study_phase, question_text, was_correct=None):
-    """Saves a response to Google Sheets, with a local JSONL fallback."""
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    response_dict = {
-        'email': email, 'age': age, 'gender': str(gender), 'timestamp': timestamp,
-        'study_phase': study_phase, 'video_id': video_data.get('video_id', 'N/A'),
-        'sample_id': caption_data.get('caption_id') or caption_data.get('comparison_id') or caption_data.get('change_id') or caption_data.get('sample_id'),
-        'question_text': question_text, 'user_choice': str(choice),
-        'was_correct': str(was_correct) if was_correct is not None else 'N/A',
-        'attempts_taken': 1 if study_phase == 'quiz' else 'N/A'
-    }
-
-    worksheet = connect_to_gsheet() # Will show error if connection fails
-
-    if worksheet:
-        try:
-            # Check if worksheet is empty to add header row
-            header_needed = False
-            try:
-                # Use a more robust check for emptiness
-                cell_list = worksheet.range('A1:A1')
-                if not cell_list[0].value:
-                    header_needed = True
-            except gspread.exceptions.APIError as api_error:
-                 st.warning(f"API Error checking sheet emptiness: {api_error}. Assuming header needed.") # Warning is okay here
-                 header_needed = True
-            except Exception as check_err:
-                 st.warning(f"Error checking sheet emptiness: {check_err}. Assuming header needed.") # Warning is okay here
-                 header_needed = True
-
-            if header_needed:
-                worksheet.append_row(list(response_dict.keys()))
-
-            worksheet.append_row(list(response_dict.values()))
-            return True
-        except Exception as e:
-            # Show error for append failure, but no traceback for user
-            st.error(f"Could not save to Google Sheets (append error): {e}. Saving a local backup.")
-            return save_response_locally(response_dict)
-    else:
-        # Error already shown in connect_to_gsheet if connection failed
-        st.error("Connection to Google Sheets failed. Saving a local backup.")
-        return save_response_locally(response_dict)
-
-@st.cache_data
-def get_video_metadata(path):
-    """Reads a video file and returns its orientation and duration."""
+def get_secrets_table(name):
+    """Returns a [name] table from secrets.toml as a dict, or {} if there is none."""
+    try:
+        return dict(st.secrets.get(name, {}))
+    except Exception: # No secrets.toml (e.g. an offline load test)
+        return {}
+
+def get_storage_config():
+    """Returns (backend, path) for response storage; env vars win over secrets.toml."""
+    storage_secrets = get_secrets_table("storage")
+    backend = os.environ.get("ROADTONES_STORAGE_BACKEND") or storage_secrets.get("backend", STORAGE_BACKEND)
+    path = os.environ.get("ROADTONES_STORAGE_PATH") or storage_secrets.get("path") or STORAGE_PATHS.get(backend)
+    return backend, path
+
+def get_media_config():
+    """Returns (base_url, serve_port) of the media server; (None, None) means st.video reads the files."""
+    media_secrets = get_secrets_table("media")
+    serve_port = media_secrets.get("serve_port")
+    base_url = os.environ.get("ROADTONES_MEDIA_URL") or media_secrets.get("base_url")
+    if serve_port and not base_url:
+        # The URL is sent to participants' browsers, so only the operator knows its public address
+        report_media_config_error("[media] serve_port is set without base_url (or ROADTONES_MEDIA_URL); "
+                                  "not starting the media server, st.video serves the clips instead")
+        return None, None
+    return base_url, serve_port
+
+@st.cache_resource
+def report_media_config_error(message):
+    """Logs a media configuration problem once per process."""
+    logger.error(message)
+
+@st.cache_resource
+def get_media_server(port):
+    """In-process media server, started once per process when [media] serve_port is set."""
+    return start_in_background(MEDIA_DIR, port=int(port))
+
+def media_url(path):
+    """Versioned URL of a file under media/ on the configured media server, or None without one.
+
+    The ?v= content hash changes whenever the file is re-encoded, so caches can keep a URL forever.
+    """
+    base_url, serve_port = get_media_config()
+    if serve_port:
+        get_media_server(serve_port)
+    relative_path = os.path.relpath(path, MEDIA_DIR)
+    if not base_url or relative_path.startswith(".."):
+        return None
+    url = urllib.parse.urljoin(base_url.rstrip("/") + "/", urllib.parse.quote(relative_path.replace(os.sep, "/")))
+    content_hash = get_media_index().content_hash(path)
+    return f"{url}?v={content_hash[:MEDIA_URL_HASH_LENGTH]}" if content_hash else url
+
+def video_source(path):
+    """What a player should load: the clip (or its smallest adequate rendition), by URL if a media server is configured."""
+    playback_path = get_media_index().playback_path(path, RENDITION_MIN_SHORT_SIDE)
+    return media_url(playback_path) or playback_path
+
+def show_video(path, loop=False):
+    """Plays a clip muted and autoplaying.
+
+    Poster frames need a media server ([media] base_url): st.video has no poster option, so with
+    the default setup the player stays blank until the clip starts.
+    """
+    src = video_source(path)
+    if not src.startswith(("http://", "https://")):
+        st.video(src, autoplay=True, muted=True, loop=loop)
+        return
+    poster = get_media_index().poster_path(path)
+    poster_url = media_url(poster) if poster else None
+    attributes = ' loop' if loop else ''
+    if poster_url:
+        attributes += f' poster="{html.escape(poster_url)}"'
+    st.html(f'<video src="{html.escape(src)}"{attributes} autoplay muted playsinline controls preload="auto" style="width: 100%;"></video>')
+
+def video_finished(key, duration):
+    """True once the browser has reported that the clip on the page finished playing.
+
+    Nothing runs on the server while the clip plays: the script run ends, and the player's
+    end comes back through streamlit_js_eval, which triggers the next rerun.
+    """
+    timeout_ms = int(max(duration, 1) * VIDEO_END_TIMEOUT_FACTOR * 1000)
+    result = streamlit_js_eval(js_expressions=JS_WAIT_FOR_VIDEO_END.replace("__TIMEOUT_MS__", str(timeout_ms)), key=key)
+    if result == 'timeout':
+        logger.info("No end of playback reported for %s; continuing after %d ms", key, timeout_ms)
+    return result is not None
+
+def streamlit_media_url(path):
+    """The URL st.video will serve a local clip from, registering the clip with Streamlit's media store now.
+
+    Media files are keyed by content, so the next run's st.video call gets the same URL. The media
+    file manager is not public API (requirements.txt pins streamlit), so if it changes the prefetch
+    is skipped, never the page.
+    """
+    if not runtime.exists():
+        return None
     try:
-        cap = cv2.VideoCapture(path)
-        if not cap.isOpened():
-            # Default values if video can't be opened
-            return {"orientation": "landscape", "duration": 10}
-        width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-        height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
-        cap.release()
-        orientation = "portrait" if height > width else "landscape"
-        duration = math.ceil(frame_count / fps) if fps > 0 and frame_count > 0 else 10 # Default duration if metadata is invalid
-        return {"orientation": orientation, "duration": duration}
-    except Exception:
-        # Fallback in case of any error during processing
-        return {"orientation": "landscape", "duration": 10}
-
-@st.cache_data
+        url = runtime.get_instance().media_file_mgr.add(path, "video/mp4", f"prefetch.{path}")
+    except Exception as e:
+        logger.warning("Not prefetching %s: %s", path, e)
+        return None
+    base_path = st.get_option("server.baseUrlPath").strip("/")
+    return f"/{base_path}{url}" if base_path else url
+
+def prefetch_next_video(part_key, index):
+    """Has the browser download the next study clip in the background while all_data['study'][part_key][index] is answered.
+
+    The next clip may be the first one of the following part (Part 1 videos, then Part 2 changes, then Part 3 comparisons).
+    """
+    items = [item for key in STUDY_PART_KEYS for item in all_data['study'].get(key, [])]
+    position = sum(len(all_data['study'].get(key, [])) for key in STUDY_PART_KEYS[:STUDY_PART_KEYS.index(part_key)]) + index
+    if position + 1 >= len(items) or 'video_path' not in items[position + 1]:
+        return
+    next_path = items[position + 1]['video_path']
+    if next_path == items[position].get('video_path'):
+        return
+    src = video_source(next_path)
+    if not src.startswith(("http://", "https://")):
+        if not os.path.exists(src):
+            return
+        src = streamlit_media_url(src)
+    if src:
+        st.html(f'<video src="{html.escape(src)}" preload="auto" muted playsinline style="display:none"></video>')
+
+def get_profile_path():
+    """Trace file for rerun profiling, or None when profiling is off."""
+    return os.environ.get("ROADTONES_PROFILE") or get_secrets_table("profiling").get("path")
+
+@st.cache_resource
+def get_rerun_profiler(path):
+    """Process-wide writer of rerun traces (see rerun_profiler.py)."""
+    patch_script_control(st)
+    return RerunProfiler(path)
+
+def start_rerun_trace():
+    """Starts timing this script run if profiling is on; returns a no-op trace otherwise."""
+    profile_path = get_profile_path()
+    if not profile_path:
+        return NULL_TRACE
+    if 'profile_session_id' not in st.session_state:
+        st.session_state.profile_session_id = new_session_id()
+    return get_rerun_profiler(profile_path).start(st.session_state.profile_session_id)
+
+def traced_fragment(step):
+    """Decorator (under @st.fragment) timing each fragment-only rerun as its own trace, reported under `step`.
+
+    The fragment is defined anew by every full script run and called once inside it, where
+    that run's trace already covers it; any later call is a fragment-only rerun.
+    """
+    def decorator(fn):
+        defining_trace = current_trace()
+        calls = itertools.count()
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if next(calls) == 0 and not defining_trace.finished:
+                return fn(*args, **kwargs)
+            trace = start_rerun_trace()
+            trace.set_context(page=st.session_state.get('page'), step=step)
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException: # st.rerun()/st.stop() have already finished it as "rerun"/"stop"
+                trace.finish(ended_by="interrupted")
+                raise
+            trace.finish()
+            return result
+        return wrapper
+    return decorator
+
+def get_admin_key():
+    """Key that unlocks the live rating summary (?admin=<key>); None leaves it disabled."""
+    return os.environ.get("ROADTONES_ADMIN_KEY") or get_secrets_table("admin").get("key")
+
+@st.cache_resource
+def get_likert_codes():
+    """Choice label -> 1-based Likert code for every scale in use."""
+    with open(QUESTIONS_DATA_PATH, 'r', encoding='utf-8') as f:
+        return likert_code_map(json.load(f))
+
+@st.cache_resource
+def get_aggregate_index():
+    """Per-(sample_id, question_id) rating statistics, updated as responses are stored."""
+    return AggregateIndex(AGGREGATES_DB_PATH, get_likert_codes())
+
+@st.cache_resource
+def get_response_writer():
+    """Background writer shared by all sessions; every response is logged locally before upload."""
+    backend, path = get_storage_config()
+    storage = create_backend(backend, client=get_gsheet_client(), schema=get_sheet_schema(), path=path)
+    writer = ResponseWriter(RESPONSE_WAL_DIR, storage, on_write=[get_aggregate_index().update])
+    writer.import_jsonl(LOCAL_BACKUP_FILE) # Upload anything an earlier fallback left behind
+    return writer
+
+def get_submission_id(view_state_key):
+    """Token shared by every row of one submit, created when its questions first render.
+
+    The storage layer drops rows whose (token, question_id) it has already stored, so a
+    double-click or a rerun that re-sends the submit never writes extra rows.
+    """
+    return st.session_state[view_state_key].setdefault('submission_id', uuid.uuid4().hex)
+
+def save_responses(email, age, gender, video_data, caption_data, answers, study_phase, was_correct=None, submission_id=None):
+    """Queues all (question_id, question_text, choice) answers from one submit as a single batch."""
+    unlogged = queue_responses(get_response_writer(), get_likert_codes(), email, age, gender, video_data, caption_data, answers, study_phase, was_correct, submission_id)
+    if not unlogged:
+        return True
+    st.error("Could not write responses to the local log. Saving a local backup.")
+    return all(save_response_locally(record.to_row()) for record in unlogged)
+
+def save_response(email, age, gender, video_data, caption_data, choice, study_phase, question_text, was_correct=None, question_id=None, submission_id=None):
+    """Queues a single response for upload to Google Sheets."""
+    return save_responses(email, age, gender, video_data, caption_data, [(question_id, question_text, choice)], study_phase, was_correct=was_correct, submission_id=submission_id)
+
+@st.cache_resource
+def get_media_index():
+    """Video metadata index built offline by media_index.py."""
+    return MediaIndex(MEDIA_INDEX_PATH, check_content=False) # Deploys reset mtimes; hashing every clip on each cold start defeats the index
+
+def get_videos_metadata(paths):
+    """Returns {path: {orientation, duration}} for the distinct paths, probing only what the index lacks."""
+    described = describe_videos(paths, get_media_index())
+    return {path: {"orientation": m["orientation"], "duration": m["duration"]} for path, m in described.items() if m}
+
+def media_field(item, key, default=None):
+    """A property of an item's video: the item's own value, else the shared media record's."""
+    if key in item:
+        return item[key]
+    return all_data['media'].get(item.get('video_path'), {}).get(key, default)
+
+@st.cache_resource
 def load_data():
-    """Loads all data from external JSON files and determines video metadata."""
+    """Loads all data from external JSON files and determines video metadata.
+
+    Loaded once per process and shared by every session, so treat the result as read-only:
+    sessions keep only their own indices and answers in st.session_state.
+    """
     data = {}
     required_files = {
         "instructions": INSTRUCTIONS_PATH, "quiz": QUIZ_DATA_PATH,
@@ -160,15 +389,20 @@ def load_data():
             return None
         with open(path, 'r', encoding='utf-8') as f: data[key] = json.load(f)
 
-    if not os.path.exists(INTRO_VIDEO_PATH):
-        st.error(f"Error: Intro video not found at '{INTRO_VIDEO_PATH}'.")
+    # Check every media file in one pass against media_index.json (`python media_index.py verify` also compares hashes)
+    items = [item for section in (data['study'], data['quiz']) for part_items in section.values() for item in part_items]
+    video_paths = [item['video_path'] for item in items if 'video_path' in item]
+    data['media_problems'] = get_media_index().check_files([INTRO_VIDEO_PATH, INSTRUCTIONS_VIDEO_PATH] + video_paths)
+    missing = [path for path, problem in data['media_problems'].items() if problem == "missing"]
+    missing_required = [path for path in missing if path in (INTRO_VIDEO_PATH, INSTRUCTIONS_VIDEO_PATH)]
+    if missing_required:
+        st.error(f"Error: Intro/instructions video not found: {', '.join(missing_required)}.")
         return None
-        
-    # --- ADDED: Check for new instructions video ---
-    if not os.path.exists("media/intro_to_tone.mp4"):
-        st.error(f"Error: Instructions video not found at 'media/intro_to_tone.mp4'.")
-        return None
-    # --- END ADDED ---
+    if missing:
+        logger.warning("%d study/quiz clips are missing and get default metadata: %s", len(missing), ", ".join(missing))
+    stale = sorted(set(data['media_problems']) - set(missing))
+    if stale:
+        logger.warning("%d media files are not indexed or changed; run `python media_index.py build`: %s", len(stale), ", ".join(stale))
 
     # Flatten definitions from JSON
     flat_definitions = {}
@@ -177,34 +411,19 @@ def load_data():
     flat_definitions.update(data['definitions'].get('applications', {}))
     data['all_definitions'] = flat_definitions
 
-    # Get metadata for study videos
-    for part_key in data['study']:
-        for item in data['study'][part_key]:
-            if 'video_path' in item and os.path.exists(item['video_path']):
-                metadata = get_video_metadata(item['video_path'])
-                item['orientation'] = metadata['orientation']
-                item['duration'] = metadata['duration']
-            else:
-                # Default values if path is missing or invalid
-                item['orientation'] = 'landscape'
-                item['duration'] = 10
-
-    # Get metadata for quiz videos
-    for part_key in data['quiz']:
-         for item in data['quiz'][part_key]:
-            if 'video_path' in item and os.path.exists(item['video_path']):
-                metadata = get_video_metadata(item['video_path'])
-                item['orientation'] = metadata['orientation']
-                item['duration'] = metadata['duration']
-            else:
-                # Default values if path is missing or invalid
-                item['orientation'] = 'landscape'
-                item['duration'] = 10
+    # One shared record per video (metadata, summary, answers); a clip used by several items is probed once
+    metadata = get_videos_metadata(video_paths)
+    data['media'] = build_media_registry(items, metadata)
+
+    # Every caption's questions and reference box resolved once, so reruns only look them up
+    data['plans'] = compile_render_plans(data['study'], data['quiz'], data['questions'], ReferenceBoxes(flat_definitions))
     return data
 
 # --- UI & STYLING ---
 st.set_page_config(layout="wide", page_title="Tone-controlled Video Captioning")
-st.markdown("""
+trace = start_rerun_trace()
+with trace.section("style"):
+    st.markdown("""
 <style>
 @import url('https://fonts.googleapis.com/css2?family=Inter:wght@500;600;700&display=swap');
 @keyframes highlight-new { 0% { border-color: transparent; box-shadow: none; } 25% { border-color: #facc15; box-shadow: 0 0 8px #facc15; } 75% { border-color: #facc15; box-shadow: 0 0 8px #facc15; } 100% { border-color: transparent; box-shadow: none; } }
@@ -366,9 +585,9 @@ body[theme="dark"] .comparison-caption-box .highlight-trait {
 # --- NAVIGATION & STATE HELPERS ---
 # (Keep handle_next_quiz_question, jump_to_part, jump_to_study_part, jump_to_study_item, restart_quiz functions exactly as they were)
 def handle_next_quiz_question(view_key_to_pop):
-    part_keys = list(st.session_state.all_data['quiz'].keys())
+    part_keys = list(all_data['quiz'].keys())
     current_part_key = part_keys[st.session_state.current_part_index]
-    questions_for_part = st.session_state.all_data['quiz'][current_part_key]
+    questions_for_part = all_data['quiz'][current_part_key]
     sample = questions_for_part[st.session_state.current_sample_index]
     question_text = "N/A"
     if "Tone Controllability" in current_part_key:
@@ -453,7 +672,7 @@ def restart_quiz():
 def render_comprehension_quiz(sample, view_state_key, proceed_step):
     options_key = f"{view_state_key}_comp_options"
     if options_key not in st.session_state:
-        options = sample['distractor_answers'] + [sample['road_event_answer']]
+        options = list(media_field(sample, 'distractor_answers')) + [media_field(sample, 'road_event_answer')] # A copy: the shared list is not ours to shuffle
         random.shuffle(options)
         st.session_state[options_key] = options
     else:
@@ -463,7 +682,7 @@ def render_comprehension_quiz(sample, view_state_key, proceed_step):
 
     if st.session_state[view_state_key]['comp_feedback']:
         user_choice = st.session_state[view_state_key]['comp_choice']
-        correct_answer = sample['road_event_answer']
+        correct_answer = media_field(sample, 'road_event_answer')
 
         for opt in options:
             is_correct = (opt == correct_answer)
@@ -522,16 +741,23 @@ if 'page' not in st.session_state:
     st.session_state.current_change_index = 0
     st.session_state.comprehension_passed_video_ids = set() # --- ADDED ---
     st.session_state.scored_quiz_questions = set() # <-- ADD THIS LINE
-    st.session_state.all_data = load_data() # Load data once at the start
 
 if 'comprehension_passed_video_ids' not in st.session_state:
     st.session_state.comprehension_passed_video_ids = set()
 
-if st.session_state.all_data is None:
+with trace.section("load_data"):
+    all_data = load_data() # Shared by all sessions; not copied into st.session_state
+if all_data is None:
     st.error("Failed to load application data. Please check file paths and ensure JSON files are valid.")
     st.stop() # Stop execution if essential data is missing
 
+# --- Live rating summary for researchers (?admin=<key>) ---
+admin_key = get_admin_key()
+if admin_key and st.query_params.get("admin") == admin_key:
+    st.session_state.page = 'admin'
+
 # --- Page Rendering Logic ---
+trace.lap(f"page:{st.session_state.page}"); trace.set_context(page=st.session_state.page)
 # (Keep demographics page exactly as it was)
 if st.session_state.page == 'demographics':
     st.title("Tone-controlled Video Captioning")
@@ -559,7 +785,7 @@ elif st.session_state.page == 'intro_video':
     st.title("Introductory Video")
     _ , vid_col, _ = st.columns([1, 3, 1]) # Center the video column
     with vid_col:
-        st.video(INTRO_VIDEO_PATH, autoplay=True, muted=True)
+        show_video(INTRO_VIDEO_PATH)
     if st.button("Next >>"):
         st.session_state.page = 'instructions_video' # --- CHANGED ---
         st.rerun()
@@ -569,7 +795,7 @@ elif st.session_state.page == 'instructions_video':
     st.title("Instructions")
     _ , vid_col, _ = st.columns([1, 3, 1]) # Center the video column
     with vid_col:
-        st.video("media/intro_to_tone.mp4", autoplay=True, muted=True, loop=True)
+        show_video(INSTRUCTIONS_VIDEO_PATH, loop=True)
 
     st.markdown("<br>", unsafe_allow_html=True) # Add a little space
     prev_col, _, next_col = st.columns([1, 5, 1]) # Adjust ratios for left/right placement
@@ -589,23 +815,22 @@ elif st.session_state.page == 'instructions_video':
 
 
 elif st.session_state.page == 'quiz':
-    part_keys = list(st.session_state.all_data['quiz'].keys())
+    part_keys = list(all_data['quiz'].keys())
     
     # Check if quiz is completed
     if st.session_state.current_part_index >= len(part_keys):
         st.session_state.page = 'quiz_results'
         st.rerun()
 
-    ALL_DEFINITIONS = st.session_state.all_data['all_definitions']
-
     current_part_key = part_keys[st.session_state.current_part_index]
-    questions_for_part = st.session_state.all_data['quiz'][current_part_key]
+    questions_for_part = all_data['quiz'][current_part_key]
     current_sample_index = st.session_state.current_sample_index # Renamed for clarity
     sample = questions_for_part[current_sample_index]
     sample_id = sample.get('sample_id', f'quiz_{current_sample_index}') # Unique ID for state keys
 
     # --- ADDED BLOCK: Check for specific quiz question to skip steps ---
     is_part2_first_question = (current_part_key == "Part 2: Tone Controllability Evaluation" and current_sample_index == 0)
+    trace.set_context(step=f"quiz{st.session_state.current_part_index + 1}:watch")
     # --- END ADDED BLOCK ---
 
     # --- Initial video play timer ---
@@ -618,19 +843,18 @@ elif st.session_state.page == 'quiz':
     if not st.session_state.get(timer_finished_key, False) and not is_second_quality_question and not is_part2_first_question:
     # --- END MODIFIED ---
         st.subheader("Watch the video")
-        with st.spinner(" "): # Added spinner text
-            col1, _ = st.columns([1.2, 1.5])
-            with col1:
-                if sample.get("orientation") == "portrait":
-                    _, vid_col, _ = st.columns([1, 3, 1])
-                    with vid_col:
-                        st.video(sample['video_path'], autoplay=True, muted=True)
-                else:
-                    st.video(sample['video_path'], autoplay=True, muted=True)
-            duration = sample.get('duration', 10) # Get duration from metadata
-            time.sleep(duration) # Pause execution for video duration
-        st.session_state[timer_finished_key] = True # Mark timer as finished
-        st.rerun() # Rerun to proceed to the next step
+        col1, _ = st.columns([1.2, 1.5])
+        with col1:
+            if media_field(sample, "orientation") == "portrait":
+                _, vid_col, _ = st.columns([1, 3, 1])
+                with vid_col:
+                    show_video(sample['video_path'])
+            else:
+                show_video(sample['video_path'])
+        duration = media_field(sample, 'duration', 10) # Get duration from metadata
+        if video_finished(f"video_end_{timer_finished_key}", duration): # The browser reports the end of playback
+            st.session_state[timer_finished_key] = True # Mark timer as finished
+            st.rerun() # Rerun to proceed to the next step
     else: # Video finished playing or skipped (second quality question)
         # --- State management for steps within a question ---
         view_state_key = f'view_state_{sample_id}'
@@ -643,6 +867,7 @@ elif st.session_state.page == 'quiz':
             # --- END ADDED BLOCK ---
             st.session_state[view_state_key] = {'step': initial_step, 'summary_typed': False, 'comp_feedback': False, 'comp_choice': None}
         current_step = st.session_state[view_state_key]['step']
+        trace.set_context(step=f"quiz{st.session_state.current_part_index + 1}:{current_step}")
 
         def stream_text(text):
             for word in text.split(" "): yield word + " "; time.sleep(0.1)
@@ -662,12 +887,12 @@ elif st.session_state.page == 'quiz':
                 st.subheader("Video")
 
             # Always show the video player
-            if sample.get("orientation") == "portrait":
+            if media_field(sample, "orientation") == "portrait":
                 _, vid_col, _ = st.columns([1, 3, 1])
                 with vid_col:
-                    st.video(sample['video_path'], autoplay=True, muted=True)
+                    show_video(sample['video_path'])
             else:
-                st.video(sample['video_path'], autoplay=True, muted=True)
+                show_video(sample['video_path'])
 
             # Show "Proceed to Summary" button only on step 1
             if current_step == 1:
@@ -679,21 +904,21 @@ elif st.session_state.page == 'quiz':
                 # --- END ADDED LINE ---
 
             # Show Video Summary if step >= 2 (this now includes step 6 for the second question)
-            if current_step >= 2 and "video_summary" in sample:
+            if current_step >= 2 and media_field(sample, "video_summary") is not None:
                 st.subheader("Video Summary")
                 summary_typed_key = f"{view_state_key}_summary_typed"
 
                 # If summary is already typed (i.e., first question done), just show it
                 # --- MODIFIED: Don't stream for part 2 first question ---
                 if st.session_state.get(summary_typed_key, False) or is_part2_first_question:
-                    st.info(sample["video_summary"])
+                    st.info(media_field(sample, "video_summary"))
                     if is_part2_first_question: # Ensure it's marked as typed if we skipped to it
                          st.session_state[summary_typed_key] = True
                 # --- END MODIFIED ---
                 else:
                     # Otherwise, stream it for the first time
                     with st.empty(): # Use empty container for streaming
-                        st.write_stream(stream_text(sample["video_summary"]))
+                        st.write_stream(stream_text(media_field(sample, "video_summary")))
                     st.session_state[summary_typed_key] = True # Mark as typed
 
                 # Show "Proceed to Question" button only on step 2
@@ -725,7 +950,6 @@ elif st.session_state.page == 'quiz':
 
             # Get the specific question data for Caption Quality part
             question_data = sample["questions"][st.session_state.current_rating_question_index] if "Caption Quality" in current_part_key else sample
-            terms_to_define = set()
 
             # --- Display Caption(s) ---
             if current_step >= 5: # Show captions from step 5 onwards
@@ -751,6 +975,7 @@ elif st.session_state.page == 'quiz':
 
             # --- Display Question and Handle Submission ---
             if current_step >= 6:
+                submission_id = get_submission_id(view_state_key)
                 question_text_display = ""
                 # --- Determine Question Text ---
                 if "Tone Controllability" in current_part_key:
@@ -760,7 +985,6 @@ elif st.session_state.page == 'quiz':
                     change_class = "highlight-increase" if change_type == "increased" else "highlight-decrease"
                     question_text_display = f"From Caption A to B, has the level of <b class='highlight-trait'>{trait}</b> <b class='{change_class}'>{change_type}</b>?"
                     # --- END MODIFIED ---
-                    terms_to_define.add(trait)
                 elif "Caption Quality" in current_part_key:
                     raw_text = question_data["question_text"]
                     app_trait = sample.get("application") # Get application from the main sample data
@@ -769,7 +993,6 @@ elif st.session_state.page == 'quiz':
                         # Highlight if present in the question text
                         if app_trait in raw_text:
                             question_text_display = raw_text.replace(app_trait, f"<b class='highlight-trait'>{app_trait}</b>")
-                            terms_to_define.add(app_trait) # Only add if found
                         else:
                             question_text_display = raw_text # Use raw text if trait not mentioned
                     else:
@@ -778,7 +1001,6 @@ elif st.session_state.page == 'quiz':
                     # --- MODIFIED LINE ---
                     question_text_display = "Identify the <span style='color: #4f46e5;'>2 most dominant</span> tones in the caption"
                     # --- END MODIFIED LINE ---
-                    terms_to_define.update(question_data['options'])
                 else: # Tone ID Single-select
                     category_text = sample.get('category', 'tone').lower()
                     if category_text == "tone":
@@ -787,7 +1009,6 @@ elif st.session_state.page == 'quiz':
                         question_text_display = "What is the most dominant writing style in the caption?"
                     else: # Fallback for other categories
                         question_text_display = f"Identify the most dominant {category_text} in the caption"
-                    terms_to_define.update(question_data['options'])
 
                 # Display the question text in a box
                 st.markdown(f'<div class="quiz-question-box"><strong>Question {st.session_state.current_rating_question_index + 1 if "Caption Quality" in current_part_key else ""}:</strong><span class="question-text-part">{question_text_display}</span></div>', unsafe_allow_html=True)
@@ -901,7 +1122,7 @@ elif st.session_state.page == 'quiz':
                                      question_text_for_save = f"Identify dominant {'/'.join(sample.get('category','tone').split())}" # More specific default
 
 
-                                success = save_response(st.session_state.email, st.session_state.age, st.session_state.gender, sample, sample, choice, 'quiz', question_text_for_save, was_correct=is_correct)
+                                success = save_response(st.session_state.email, st.session_state.age, st.session_state.gender, sample, sample, choice, StudyPhase.QUIZ, question_text_for_save, was_correct=is_correct, question_id=question_unique_id, submission_id=submission_id)
                                 # --- End save response ---
 
                                 if success:
@@ -913,15 +1134,16 @@ elif st.session_state.page == 'quiz':
                 # --- END OF CODE BLOCK TO REPLACE ---
 
                 # --- Display Reference Box ---
-                if terms_to_define:
-                    reference_html = '<div class="reference-box"><h3>Reference</h3><ul>' + "".join(f"<li><strong>{term}:</strong> {ALL_DEFINITIONS.get(term, 'Definition not found.')}</li>" for term in sorted(list(terms_to_define)) if ALL_DEFINITIONS.get(term)) + "</ul></div>" # Added fallback text
+                question_index = st.session_state.current_rating_question_index if "Caption Quality" in current_part_key else 0
+                reference_html = all_data['plans']['quiz'][current_part_key][st.session_state.current_sample_index][question_index] # Precomputed at load time
+                if reference_html:
                     st.markdown(reference_html, unsafe_allow_html=True)
 
 
 elif st.session_state.page == 'quiz_results':
     # Calculate total scorable questions accurately
     total_scorable_questions = 0
-    for p_name, q_list in st.session_state.all_data['quiz'].items():
+    for p_name, q_list in all_data['quiz'].items():
         if "Caption Quality" in p_name:
             # For Caption Quality, count sub-questions within each sample
             total_scorable_questions += sum(len(item.get("questions", [])) for item in q_list)
@@ -943,9 +1165,7 @@ elif st.session_state.page == 'quiz_results':
 
 elif st.session_state.page == 'user_study_main':
     # (Keep user_study_main page logic exactly as it was, including the skip logic for repeated videos)
-    if not st.session_state.all_data: st.error("Data could not be loaded."); st.stop()
-
-    ALL_DEFINITIONS = st.session_state.all_data['all_definitions']
+    if not all_data: st.error("Data could not be loaded."); st.stop()
 
     def stream_text(text):
         for word in text.split(" "): yield word + " "; time.sleep(0.1)
@@ -954,7 +1174,8 @@ elif st.session_state.page == 'user_study_main':
 
     # Part 1: Caption Rating (Remains mostly the same)
     if st.session_state.study_part == 1:
-        all_videos = st.session_state.all_data['study']['part1_ratings']
+        trace.lap("study_part1"); trace.set_context(step="part1:watch")
+        all_videos = all_data['study']['part1_ratings']
         video_idx, caption_idx = st.session_state.current_video_index, st.session_state.current_caption_index
         # --- Progression updated ---
         if video_idx >= len(all_videos):
@@ -973,37 +1194,20 @@ elif st.session_state.page == 'user_study_main':
         if not st.session_state.get(timer_finished_key, False) and caption_idx == 0 and not has_been_watched:
         # --- END MODIFIED ---
             st.subheader("Watch the video")
-            with st.spinner(""):
-                main_col, _ = st.columns([1, 1.8])
-                with main_col:
-                    if current_video.get("orientation") == "portrait":
-                        _, vid_col, _ = st.columns([1, 3, 1])
-                        with vid_col: st.video(current_video['video_path'], autoplay=True, muted=True)
-                    else:
-                        st.video(current_video['video_path'], autoplay=True, muted=True)
-                    duration = current_video.get('duration', 10)
-                    time.sleep(duration)
-            st.session_state[timer_finished_key] = True
-            st.rerun()
+            main_col, _ = st.columns([1, 1.8])
+            with main_col:
+                if media_field(current_video, "orientation") == "portrait":
+                    _, vid_col, _ = st.columns([1, 3, 1])
+                    with vid_col: show_video(current_video['video_path'])
+                else:
+                    show_video(current_video['video_path'])
+            if video_finished(f"video_end_{timer_finished_key}", media_field(current_video, 'duration', 10)):
+                st.session_state[timer_finished_key] = True
+                st.rerun()
         else:
             current_caption = current_video['captions'][caption_idx]
             view_state_key = f"view_state_p1_{current_caption['caption_id']}"; summary_typed_key = f"summary_typed_{current_video['video_id']}"
-            q_templates = st.session_state.all_data['questions']['part1_questions'] # Part 1 questions
-            
-            # --- MODIFIED: Added 'overall_relevance' as the 3rd question ---
-            # Define the exact order of questions
-            question_ids = ["tone_relevance", "style_relevance", "overall_relevance", "factual_consistency", "usefulness", "human_likeness"]
-            # Keep questions_to_ask_raw as the full list from q_templates (it's used for lookups)
-            questions_to_ask_raw = q_templates
-            options_map = {
-                "tone_relevance": ["Not at all", "Weak", "Moderate", "Strong", "Very Strong"],
-                "style_relevance": ["Not at all", "Weak", "Moderate", "Strong", "Very Strong"],
-                "overall_relevance": ["Not at all", "Weak", "Moderate", "Strong", "Very Strong"], # ADDED
-                "factual_consistency": ["Contradicts", "Inaccurate", "Partially", "Mostly Accurate", "Accurate"],
-                "usefulness": ["Not at all", "Slightly", "Moderately", "Very", "Extremely"],
-                "human_likeness": ["Robotic", "Unnatural", "Moderate", "Very Human-like", "Natural"]
-            }
-            # --- END MODIFIED ---
+            question_ids = PART1_QUESTION_IDS # The exact order of questions
 
             if view_state_key not in st.session_state:
                 initial_step = 5 if caption_idx > 0 else 1
@@ -1019,6 +1223,7 @@ elif st.session_state.page == 'user_study_main':
                 # --- END MODIFIED ---
 
             current_step = st.session_state[view_state_key]['step']
+            trace.set_context(step=f"part1:{current_step}")
 
             def mark_interacted(q_id, view_key, question_index):
                 if view_key in st.session_state and 'interacted' in st.session_state[view_key]:
@@ -1035,11 +1240,12 @@ elif st.session_state.page == 'user_study_main':
 
             col1, col2 = st.columns([1, 1.8])
             with col1:
-                if current_video.get("orientation") == "portrait":
+                if media_field(current_video, "orientation") == "portrait":
                     _, vid_col, _ = st.columns([1, 3, 1])
-                    with vid_col: st.video(current_video['video_path'], autoplay=True, muted=True)
+                    with vid_col: show_video(current_video['video_path'])
                 else:
-                    st.video(current_video['video_path'], autoplay=True, muted=True)
+                    show_video(current_video['video_path'])
+                prefetch_next_video("part1_ratings", video_idx)
 
                 if caption_idx == 0:
                     if current_step == 1:
@@ -1050,9 +1256,9 @@ elif st.session_state.page == 'user_study_main':
                         # --- END ADDED LINE ---
                     elif current_step >= 2:
                         st.subheader("Video Summary")
-                        if st.session_state.get(summary_typed_key, False): st.info(current_video["video_summary"])
+                        if st.session_state.get(summary_typed_key, False): st.info(media_field(current_video, "video_summary"))
                         else:
-                            with st.empty(): st.write_stream(stream_text(current_video["video_summary"]))
+                            with st.empty(): st.write_stream(stream_text(media_field(current_video, "video_summary")))
                             st.session_state[summary_typed_key] = True
                         if current_step == 2 and st.button("Proceed to Question", key=f"p1_proceed_comp_q_{video_idx}"):
                             st.session_state[view_state_key]['step'] = 3; st.rerun()
@@ -1061,14 +1267,13 @@ elif st.session_state.page == 'user_study_main':
                             streamlit_js_eval(js_expressions=JS_ANIMATION_RESET, key=f"anim_reset_study_1_2_{video_idx}")
                         # --- END ADDED LINE ---
                 else:
-                    st.subheader("Video Summary"); st.info(current_video["video_summary"])
+                    st.subheader("Video Summary"); st.info(media_field(current_video, "video_summary"))
 
             with col2:
                 validation_placeholder = st.empty()
                 if (current_step == 3 or current_step == 4) and caption_idx == 0:
                     render_comprehension_quiz(current_video, view_state_key, proceed_step=5)
 
-                terms_to_define = set()
                 if current_step >= 5:
                     colors = ["#FFEEEE", "#EBF5FF", "#E6F7EA"]; highlight_color = colors[caption_idx % len(colors)]
                     caption_box_class = "part1-caption-box new-caption-highlight"
@@ -1077,145 +1282,64 @@ elif st.session_state.page == 'user_study_main':
                     if current_step == 5 and st.button("Show Questions", key=f"show_q_{current_caption['caption_id']}"):
                         st.session_state[view_state_key]['step'] = 6; st.rerun()
                 if current_step >= 6:
-                    control_scores = current_caption.get("control_scores", {})
-                    tone_traits = list(control_scores.get("tone", {}).keys())[:2]
-                    style_traits = list(control_scores.get("writing_style", {}).keys())[:2]
-                    application_text = current_caption.get("application", "the intended application")
-
-                    terms_to_define.update(tone_traits)
-                    terms_to_define.add(application_text)
-
-                    # --- MODIFIED: format_traits function with color ---
-                    def format_traits(traits, color_hex):
-                        highlighted = [f"<b style='color:{color_hex}; font-weight: 700;'>{trait}</b>" for trait in traits]
-                        if len(highlighted) > 1: return " and ".join(highlighted)
-                        return highlighted[0] if highlighted else ""
-                    # --- END MODIFIED ---
-
-                    tone_str = format_traits(tone_traits, "#000099") # Apply blue
-
-                    # --- Handle Style Relevance Overrides ---
-                    style_q_template_obj = next((q for q in questions_to_ask_raw if q['id'] == 'style_relevance'), None)
-                    style_overrides = style_q_template_obj.get('overrides', {}) if style_q_template_obj else {}
-                    found_override = False
-                    style_q_text_final = ""
-                    style_q_options_final = []
-
-                    for trait in style_traits:
-                        if trait in style_overrides:
-                            style_q_text_final = style_overrides[trait]['text']
-                            # --- MODIFIED: Apply brown color to override trait ---
-                            style_q_text_final = style_q_text_final.replace("<b class='highlight-trait'>", "<b style='color:#663300; font-weight: 700;'>")
-                            # --- END MODIFIED ---
-                            style_q_options_final = style_overrides[trait]['options']
-                            terms_to_define.add(trait)
-                            found_override = True
-                            break
-
-                    if not found_override:
-                        style_str = format_traits(style_traits, "#663300") # Apply brown
-                        default_text = "How {} is the caption's style?"
-                        default_options = ["Not at all", "Weak", "Moderate", "Strong", "Very Strong"]
-                        if style_q_template_obj:
-                            default_text = style_q_template_obj.get('default_text', default_text)
-                            default_options = style_q_template_obj.get('default_options', default_options)
-                        style_q_text_final = default_text.format(style_str)
-                        style_q_options_final = default_options
-                        terms_to_define.update(style_traits)
-
-                    options_map['style_relevance'] = style_q_options_final # Update the options map
-                    # --- End Handle Style Relevance Overrides ---
-
-                    # --- MODIFIED: Updated fallback text to match JSON ---
-                    tone_q_template = next((q['text'] for q in questions_to_ask_raw if q['id'] == 'tone_relevance'), "How {} does the caption sound?")
-                    # overall_q_template = next((q['text'] for q in questions_to_ask_raw if q['id'] == 'overall_relevance'), "How relevant are the tone and style for the given video?") # No longer needed
-                    fact_q_template = next((q['text'] for q in questions_to_ask_raw if q['id'] == 'factual_consistency'), "How factually accurate is the caption (refer to video and summary)?")
-                    useful_q_template = next((q['text'] for q in questions_to_ask_raw if q['id'] == 'usefulness'), "How useful would this caption be for {}?")
-                    human_q_template = next((q['text'] for q in questions_to_ask_raw if q['id'] == 'human_likeness'), "How human-like does this caption sound?")
-                    # --- END MODIFIED ---
-
-                    # --- MODIFIED: Added 'overall_relevance' with new text ---
-                    questions_to_ask = [
-                        {"id": "tone_relevance", "text": tone_q_template.format(tone_str)},
-                        {"id": "style_relevance", "text": style_q_text_final},
-                        # --- THIS IS THE MODIFIED LINE ---
-                        {"id": "overall_relevance", "text": "How relevant are the <span style='color:#000099;'><b>Tone</b></span> and <span style='color:#663300;'><b>Style</b></span> for the given video? <span style='font-size: 0.9rem; font-weight: 500;'>(e.g., for a Traffic Authority, social media influencer or for yourself)</span>"},
-                        # --- END OF MODIFIED LINE ---
-                        {"id": "factual_consistency", "text": fact_q_template},
-                        {"id": "usefulness", "text": useful_q_template.format(f"<b class='highlight-trait'>{application_text}</b>")},
-                        {"id": "human_likeness", "text": human_q_template}
-                    ]
-                    # --- END MODIFIED ---
-
-                    interacted_state = st.session_state.get(view_state_key, {}).get('interacted', {})
-                    question_cols_row1 = st.columns(3); question_cols_row2 = st.columns(3)
-
-                    # --- MODIFIED: render_slider function ---
-                    def render_slider(q, col, q_index, view_key_arg):
-                        with col:
-                            slider_key = f"ss_{q['id']}_cap{caption_idx}"
-                            
-                            # --- START NEW LOGIC ---
-                            super_label = ""
-                            if q['id'] == "tone_relevance":
-                                super_label = "<div class='question-super-label' style='color: #000099;'>Tone</div>"
-                            elif q['id'] == "style_relevance":
-                                super_label = "<div class='question-super-label' style='color: #663300;'>Style</div>"
-                            else:
-                                # Add an empty div to maintain alignment
-                                super_label = "<div class='question-super-label'>&nbsp;</div>" 
-                            
-                            # Add question text
-                            question_text = f"<strong>{q_index + 1}. {q['text']}</strong>"
-                            
-                            st.markdown(f"<div class='slider-label'>{super_label}<div class='slider-question-text'>{question_text}</div></div>", unsafe_allow_html=True)
-                            # --- END NEW LOGIC ---
-                            
-                            st.select_slider(q['id'], options=options_map[q['id']], key=slider_key, label_visibility="collapsed", on_change=mark_interacted, args=(q['id'], view_key_arg, q_index), value=options_map[q['id']][0])
-                    # --- END MODIFIED ---
-
-                    num_interacted = sum(1 for flag in interacted_state.values() if flag)
-                    questions_to_show = num_interacted + 1
-
-                    # --- MODIFIED: Render 6 sliders now ---
-                    if questions_to_show >= 1: render_slider(questions_to_ask[0], question_cols_row1[0], 0, view_state_key)
-                    if questions_to_show >= 2: render_slider(questions_to_ask[1], question_cols_row1[1], 1, view_state_key)
-                    if questions_to_show >= 3: render_slider(questions_to_ask[2], question_cols_row1[2], 2, view_state_key)
-                    if questions_to_show >= 4: render_slider(questions_to_ask[3], question_cols_row2[0], 3, view_state_key)
-                    if questions_to_show >= 5: render_slider(questions_to_ask[4], question_cols_row2[1], 4, view_state_key)
-                    if questions_to_show >= 6: render_slider(questions_to_ask[5], question_cols_row2[2], 5, view_state_key)
-                    # --- END MODIFIED ---
-
-                    if questions_to_show > len(questions_to_ask):
-                        if st.button("Submit Ratings", key=f"submit_cap{caption_idx}"):
-                            all_interacted = all(interacted_state.get(qid, False) for qid in question_ids)
-                            if not all_interacted:
-                                missing_qs = [i+1 for i, qid in enumerate(question_ids) if not interacted_state.get(qid, False)]
-                                validation_placeholder.warning(f"⚠️ Please move the slider for question(s): {', '.join(map(str, missing_qs))}")
-                            else:
-                                with st.spinner("Saving response..."): # Spinner added
-                                    all_saved = True
-                                    responses_to_save = {qid: st.session_state.get(f"ss_{qid}_cap{caption_idx}") for qid in question_ids}
-                                    for q_id, choice_text in responses_to_save.items():
-                                        full_q_text = next((q['text'] for q in questions_to_ask if q['id'] == q_id), "N.A.")
+                    submission_id = get_submission_id(view_state_key)
+                    plan = all_data['plans']['part1'][current_caption['caption_id']] # Question HTML, options and terms, compiled at load time
+                    questions_to_ask = plan['questions']
+
+                    @st.fragment
+                    @traced_fragment("part1:fragment")
+                    def render_rating_panel():
+                        """The sliders and submit button. Moving a slider reruns only this panel, not the video, summary and caption."""
+                        validation_placeholder.empty() # A full rerun used to clear the warning
+                        interacted_state = st.session_state.get(view_state_key, {}).get('interacted', {})
+                        question_cols_row1 = st.columns(3); question_cols_row2 = st.columns(3)
+
+                        # --- MODIFIED: render_slider function ---
+                        def render_slider(q, col, q_index, view_key_arg):
+                            with col:
+                                slider_key = f"ss_{q['id']}_cap{caption_idx}"
+                                st.markdown(q['label_html'], unsafe_allow_html=True)
+                                st.select_slider(q['id'], options=q['options'], key=slider_key, label_visibility="collapsed", on_change=mark_interacted, args=(q['id'], view_key_arg, q_index), value=q['options'][0])
+                        # --- END MODIFIED ---
+
+                        num_interacted = sum(1 for flag in interacted_state.values() if flag)
+                        questions_to_show = num_interacted + 1
+
+                        # --- MODIFIED: Render 6 sliders now ---
+                        if questions_to_show >= 1: render_slider(questions_to_ask[0], question_cols_row1[0], 0, view_state_key)
+                        if questions_to_show >= 2: render_slider(questions_to_ask[1], question_cols_row1[1], 1, view_state_key)
+                        if questions_to_show >= 3: render_slider(questions_to_ask[2], question_cols_row1[2], 2, view_state_key)
+                        if questions_to_show >= 4: render_slider(questions_to_ask[3], question_cols_row2[0], 3, view_state_key)
+                        if questions_to_show >= 5: render_slider(questions_to_ask[4], question_cols_row2[1], 4, view_state_key)
+                        if questions_to_show >= 6: render_slider(questions_to_ask[5], question_cols_row2[2], 5, view_state_key)
+                        # --- END MODIFIED ---
+
+                        if questions_to_show > len(questions_to_ask):
+                            if st.button("Submit Ratings", key=f"submit_cap{caption_idx}"):
+                                all_interacted = all(interacted_state.get(qid, False) for qid in question_ids)
+                                if not all_interacted:
+                                    missing_qs = [i+1 for i, qid in enumerate(question_ids) if not interacted_state.get(qid, False)]
+                                    validation_placeholder.warning(f"⚠️ Please move the slider for question(s): {', '.join(map(str, missing_qs))}")
+                                else:
+                                    with st.spinner("Saving response..."): # Spinner added
+                                        responses_to_save = {qid: st.session_state.get(f"ss_{qid}_cap{caption_idx}") for qid in question_ids}
+                                        answers = [(q_id, next((q['text'] for q in questions_to_ask if q['id'] == q_id), "N.A."), choice_text) for q_id, choice_text in responses_to_save.items()]
                                         # Use correct study phase string
-                                        if not save_response(st.session_state.email, st.session_state.age, st.session_state.gender, current_video, current_caption, choice_text, 'user_study_part1', full_q_text):
-                                            all_saved = False
-                                            break
-                                if all_saved:
-                                    st.session_state.current_caption_index += 1
-                                    if st.session_state.current_caption_index >= len(current_video['captions']):
-                                        st.session_state.current_video_index += 1; st.session_state.current_caption_index = 0
-                                    st.session_state.pop(view_state_key, None); st.rerun()
-
-                    # Use definitions from session state
-                    reference_html = '<div class="reference-box"><h3>Reference</h3><ul>' + "".join(f"<li><strong>{term}:</strong> {ALL_DEFINITIONS.get(term, 'Definition not found.')}</li>" for term in sorted(list(terms_to_define)) if ALL_DEFINITIONS.get(term)) + "</ul></div>"
-                    st.markdown(reference_html, unsafe_allow_html=True)
+                                        all_saved = save_responses(st.session_state.email, st.session_state.age, st.session_state.gender, current_video, current_caption, answers, StudyPhase.PART1, submission_id=submission_id)
+                                    if all_saved:
+                                        st.session_state.current_caption_index += 1
+                                        if st.session_state.current_caption_index >= len(current_video['captions']):
+                                            st.session_state.current_video_index += 1; st.session_state.current_caption_index = 0
+                                        st.session_state.pop(view_state_key, None); st.rerun()
+                    render_rating_panel()
+
+                    st.markdown(plan['reference_html'], unsafe_allow_html=True) # Precomputed at load time
 
     # --- MODIFIED: Part 2 (Intensity Change) ---
     elif st.session_state.study_part == 2:
+        trace.lap("study_part2"); trace.set_context(step="part2:watch")
         # --- DATA KEY SWAPPED ---
-        all_changes = st.session_state.all_data['study']['part2_intensity_change'] # Changed key
+        all_changes = all_data['study']['part2_intensity_change'] # Changed key
         change_idx = st.session_state.current_change_index
         # --- Progression updated ---
         if change_idx >= len(all_changes):
@@ -1225,7 +1349,6 @@ elif st.session_state.page == 'user_study_main':
 
         current_change = all_changes[change_idx]; change_id = current_change['change_id']
         video_id = current_change.get('video_id') # --- ADDED ---
-        field_to_change = current_change['field_to_change']; field_type = list(field_to_change.keys())[0]
         timer_finished_key = f"timer_finished_{change_id}" # Keep timer key based on unique change_id
         # --- ADDED ---
         has_been_watched = video_id in st.session_state.comprehension_passed_video_ids
@@ -1235,18 +1358,16 @@ elif st.session_state.page == 'user_study_main':
         if not st.session_state.get(timer_finished_key, False) and not has_been_watched:
         # --- END MODIFIED ---
             st.subheader("Watch the video")
-            with st.spinner(""):
-                main_col, _ = st.columns([1, 1.8])
-                with main_col:
-                    if current_change.get("orientation") == "portrait":
-                        _, vid_col, _ = st.columns([1, 3, 1])
-                        with vid_col: st.video(current_change['video_path'], autoplay=True, muted=True)
-                    else:
-                        st.video(current_change['video_path'], autoplay=True, muted=True)
-                    duration = current_change.get('duration', 10)
-                    time.sleep(duration)
-            st.session_state[timer_finished_key] = True
-            st.rerun()
+            main_col, _ = st.columns([1, 1.8])
+            with main_col:
+                if media_field(current_change, "orientation") == "portrait":
+                    _, vid_col, _ = st.columns([1, 3, 1])
+                    with vid_col: show_video(current_change['video_path'])
+                else:
+                    show_video(current_change['video_path'])
+            if video_finished(f"video_end_{timer_finished_key}", media_field(current_change, 'duration', 10)):
+                st.session_state[timer_finished_key] = True
+                st.rerun()
         else:
             # --- State keys use 'p2' now ---
             view_state_key = f"view_state_p2_{change_id}"; summary_typed_key = f"summary_typed_p2_{change_id}"
@@ -1263,6 +1384,7 @@ elif st.session_state.page == 'user_study_main':
                     st.session_state[summary_typed_key] = False
                 # --- END ADDED ---
             current_step = st.session_state[view_state_key]['step']
+            trace.set_context(step=f"part2:{current_step}")
 
             title_col1, title_col2 = st.columns([1, 1.8])
             with title_col1:
@@ -1274,11 +1396,12 @@ elif st.session_state.page == 'user_study_main':
 
             col1, col2 = st.columns([1, 1.8])
             with col1:
-                if current_change.get("orientation") == "portrait":
+                if media_field(current_change, "orientation") == "portrait":
                     _, vid_col, _ = st.columns([1, 3, 1])
-                    with vid_col: st.video(current_change['video_path'], autoplay=True, muted=True)
+                    with vid_col: show_video(current_change['video_path'])
                 else:
-                    st.video(current_change['video_path'], autoplay=True, muted=True)
+                    show_video(current_change['video_path'])
+                prefetch_next_video("part2_intensity_change", change_idx)
 
                 if current_step == 1:
                     # --- Key updated ---
@@ -1289,9 +1412,9 @@ elif st.session_state.page == 'user_study_main':
                     # --- END ADDED LINE ---
                 if current_step >= 2:
                     st.subheader("Video Summary")
-                    if st.session_state.get(summary_typed_key, False): st.info(current_change["video_summary"])
+                    if st.session_state.get(summary_typed_key, False): st.info(media_field(current_change, "video_summary"))
                     else:
-                        with st.empty(): st.write_stream(stream_text(current_change["video_summary"]))
+                        with st.empty(): st.write_stream(stream_text(media_field(current_change, "video_summary")))
                         st.session_state[summary_typed_key] = True
                     # --- Key updated ---
                     if current_step == 2 and st.button("Proceed to Question", key=f"p2_proceed_captions_{change_id}"):
@@ -1314,44 +1437,15 @@ elif st.session_state.page == 'user_study_main':
                     if current_step == 5 and st.button("Show Questions", key=f"p2_show_q_{change_id}"):
                         st.session_state[view_state_key]['step'] = 6; st.rerun()
                 if current_step >= 6:
-                    terms_to_define = set()
-                    trait = field_to_change[field_type]
-                    terms_to_define.add(trait)
-
-                    q_template = None
-                    if field_type == 'writing_style':
-                        q_template_key = 'Writing Style'
-                    elif field_type == 'tone':
-                        q_template_key = 'Tone'
+                    submission_id = get_submission_id(view_state_key)
+                    plan = all_data['plans']['part2'][change_id] # Question HTML and terms, compiled at load time
+                    if plan['error']:
+                        st.error(plan['error'])
                     else:
-                        st.error(f"Unknown field type for question template: {field_type}")
-                        q_template_key = None
-
-                    if q_template_key:
-                        # --- QUESTION KEY SWAPPED ---
-                        if q_template_key not in st.session_state.all_data['questions']['part2_questions']: # Changed key
-                            st.error(f"Question template key '{q_template_key}' not found in questions.json")
-                        else:
-                            # --- QUESTION KEY SWAPPED ---
-                            q_template = st.session_state.all_data['questions']['part2_questions'][q_template_key] # Changed key
-
-                    if q_template:
                         # --- Form key updated ---
                         with st.form(key=f"study_form_p2_{change_idx}"):
-                            # --- MODIFIED FOR COLOR ---
-                            trait = field_to_change[field_type]
-                            change_type_str = current_change['change_type']
-                            change_class = "highlight-increase" if change_type_str == "increased" else "highlight-decrease"
-                            
-                            highlighted_trait = f"<b class='highlight-trait'>{trait}</b>"
-                            highlighted_change_type = f"<b class='{change_class}'>{change_type_str}</b>"
-                            dynamic_question_raw = q_template.format(highlighted_trait, change_type=highlighted_change_type)
-                            # --- END MODIFIED ---
-                            
-                            dynamic_question_save = re.sub('<[^<]+?>', '', dynamic_question_raw)
-                            # --- MODIFIED: Added context to q2_text ---
-                            q2_text = "Is the core factual content consistent across both captions (refer to video and summary)?"
-                            # --- END MODIFIED ---
+                            dynamic_question_raw, dynamic_question_save = plan['question_html'], plan['question_text']
+                            q2_text = PART2_FACTUAL_QUESTION
                             col_q1, col_q2 = st.columns(2)
                             with col_q1:
                                 st.markdown(f'<div class="part3-question-text">1. {dynamic_question_raw}</div>', unsafe_allow_html=True) # Kept class name for styling
@@ -1368,23 +1462,21 @@ elif st.session_state.page == 'user_study_main':
                                 else:
                                     with st.spinner("Saving response..."): # Spinner added
                                         # --- STUDY PHASE SWAPPED ---
-                                        success1 = save_response(st.session_state.email, st.session_state.age, st.session_state.gender, current_change, current_change, choice1, 'user_study_part2', dynamic_question_save) # Changed phase
-                                        success2 = save_response(st.session_state.email, st.session_state.age, st.session_state.gender, current_change, current_change, choice2, 'user_study_part2', q2_text) # Changed phase
-                                    if success1 and success2:
+                                        success = save_responses(st.session_state.email, st.session_state.age, st.session_state.gender, current_change, current_change, [('part2_intensity_change', dynamic_question_save, choice1), ('part2_factual_consistency', q2_text, choice2)], StudyPhase.PART2, submission_id=submission_id) # Changed phase
+                                    if success:
                                         st.session_state.current_change_index += 1
                                         st.session_state.pop(view_state_key, None)
                                         st.rerun()
 
-                    if terms_to_define:
-                        reference_html = '<div class="reference-box"><h3>Reference</h3><ul>' + "".join(f"<li><strong>{term}:</strong> {ALL_DEFINITIONS.get(term, 'Definition not found.')}</li>" for term in sorted(list(terms_to_define)) if ALL_DEFINITIONS.get(term)) + "</ul></div>"
-                        st.markdown(reference_html, unsafe_allow_html=True)
+                    st.markdown(plan['reference_html'], unsafe_allow_html=True) # Precomputed at load time
 
 
     # --- ###################################################### ---
     # --- ############# START: MAJOR CHANGE TO PART 3 ############# ---
     # --- ###################################################### ---
     elif st.session_state.study_part == 3: 
-        all_comparisons = st.session_state.all_data['study']['part3_comparisons'] 
+        trace.lap("study_part3"); trace.set_context(step="part3:watch")
+        all_comparisons = all_data['study']['part3_comparisons'] 
         comp_idx = st.session_state.current_comparison_index
         
         if comp_idx >= len(all_comparisons):
@@ -1398,31 +1490,20 @@ elif st.session_state.page == 'user_study_main':
         
         if not st.session_state.get(timer_finished_key, False) and not has_been_watched:
             st.subheader("Watch the video")
-            with st.spinner(""):
-                main_col, _ = st.columns([1, 1.8])
-                with main_col:
-                    if current_comp.get("orientation") == "portrait":
-                        _, vid_col, _ = st.columns([1, 3, 1])
-                        with vid_col: st.video(current_comp['video_path'], autoplay=True, muted=True)
-                    else:
-                        st.video(current_comp['video_path'], autoplay=True, muted=True)
-                    duration = current_comp.get('duration', 10)
-                    time.sleep(duration)
-            st.session_state[timer_finished_key] = True
-            st.rerun()
+            main_col, _ = st.columns([1, 1.8])
+            with main_col:
+                if media_field(current_comp, "orientation") == "portrait":
+                    _, vid_col, _ = st.columns([1, 3, 1])
+                    with vid_col: show_video(current_comp['video_path'])
+                else:
+                    show_video(current_comp['video_path'])
+            if video_finished(f"video_end_{timer_finished_key}", media_field(current_comp, 'duration', 10)):
+                st.session_state[timer_finished_key] = True
+                st.rerun()
         else:
             view_state_key = f"view_state_p3_{comparison_id}"; summary_typed_key = f"summary_typed_p3_{comparison_id}"
             
-            # --- MODIFIED: New question IDs for Part 3, like Part 1 ---
-            question_ids = ["part3_tone_relevance", "part3_style_relevance", "part3_factual_consistency"]
-            options_map = {
-                "part3_tone_relevance": ["Not at all", "Weak", "Moderate", "Strong", "Very Strong"],
-                "part3_style_relevance": ["Not at all", "Weak", "Moderate", "Strong", "Very Strong"],
-                "part3_factual_consistency": ["Contradicts", "Inaccurate", "Partially", "Mostly Accurate", "Accurate"]
-            }
-            # Get question templates from Part 1
-            part1_q_templates = st.session_state.all_data['questions']['part1_questions']
-            # --- END MODIFIED ---
+            question_ids = PART3_QUESTION_IDS # Like Part 1, with Part 1's question templates
 
             if view_state_key not in st.session_state:
                 initial_step = 1
@@ -1436,6 +1517,7 @@ elif st.session_state.page == 'user_study_main':
                     st.session_state[summary_typed_key] = False
                 
             current_step = st.session_state[view_state_key]['step']
+            trace.set_context(step=f"part3:{current_step}")
 
             # --- ADDED: mark_p3_interacted function (like part 1) ---
             def mark_p3_interacted(q_id, view_key, question_index):
@@ -1454,11 +1536,12 @@ elif st.session_state.page == 'user_study_main':
 
             col1, col2 = st.columns([1, 1.8])
             with col1:
-                if current_comp.get("orientation") == "portrait":
+                if media_field(current_comp, "orientation") == "portrait":
                     _, vid_col, _ = st.columns([1, 3, 1])
-                    with vid_col: st.video(current_comp['video_path'], autoplay=True, muted=True)
+                    with vid_col: show_video(current_comp['video_path'])
                 else:
-                    st.video(current_comp['video_path'], autoplay=True, muted=True)
+                    show_video(current_comp['video_path'])
+                prefetch_next_video("part3_comparisons", comp_idx)
 
                 if current_step == 1:
                     if st.button("Proceed to Summary", key=f"p3_proceed_summary_{comparison_id}"):
@@ -1466,9 +1549,9 @@ elif st.session_state.page == 'user_study_main':
                     streamlit_js_eval(js_expressions=JS_ANIMATION_RESET, key=f"anim_reset_study_3_1_{comparison_id}")
                 if current_step >= 2:
                     st.subheader("Video Summary")
-                    if st.session_state.get(summary_typed_key, False): st.info(current_comp["video_summary"])
+                    if st.session_state.get(summary_typed_key, False): st.info(media_field(current_comp, "video_summary"))
                     else:
-                        with st.empty(): st.write_stream(stream_text(current_comp["video_summary"]))
+                        with st.empty(): st.write_stream(stream_text(media_field(current_comp, "video_summary")))
                         st.session_state[summary_typed_key] = True
                     if current_step == 2 and st.button("Proceed to Question", key=f"p3_proceed_captions_{comparison_id}"):
                         st.session_state[view_state_key]['step'] = 3; st.rerun()
@@ -1480,7 +1563,6 @@ elif st.session_state.page == 'user_study_main':
                     render_comprehension_quiz(current_comp, view_state_key, proceed_step=5)
 
                 validation_placeholder = st.empty()
-                terms_to_define = set()
                 if current_step >= 5:
                     # --- MODIFIED: Show only one caption (caption_A) ---
                     st.markdown(f'<div class="comparison-caption-box"><strong>Caption</strong><p class="caption-text">{current_comp["caption_B"]}</p></div>', unsafe_allow_html=True)
@@ -1492,122 +1574,59 @@ elif st.session_state.page == 'user_study_main':
                 
                 # --- MODIFIED: New Step 6 logic with 3 sliders, like Part 1 ---
                 if current_step >= 6:
-                    control_scores = current_comp.get("control_scores", {})
-                    # Get traits *without* intensity
-                    tone_traits = list(control_scores.get("tone", {}).keys())
-                    style_traits = list(control_scores.get("writing_style", {}).keys())
-                    
-                    terms_to_define.update(tone_traits)
-
-                    # Copied from Part 1: format_traits function with color
-                    def format_traits(traits, color_hex):
-                        highlighted = [f"<b style='color:{color_hex}; font-weight: 700;'>{trait}</b>" for trait in traits]
-                        if len(highlighted) > 1: return " and ".join(highlighted)
-                        return highlighted[0] if highlighted else ""
-
-                    tone_str = format_traits(tone_traits, "#000099") # Apply blue
-
-                    # Copied from Part 1: Handle Style Relevance Overrides
-                    style_q_template_obj = next((q for q in part1_q_templates if q['id'] == 'style_relevance'), None)
-                    style_overrides = style_q_template_obj.get('overrides', {}) if style_q_template_obj else {}
-                    found_override = False
-                    style_q_text_final = ""
-                    style_q_options_final = []
-
-                    for trait in style_traits:
-                        if trait in style_overrides:
-                            style_q_text_final = style_overrides[trait]['text']
-                            style_q_text_final = style_q_text_final.replace("<b class='highlight-trait'>", "<b style='color:#663300; font-weight: 700;'>")
-                            style_q_options_final = style_overrides[trait]['options']
-                            terms_to_define.add(trait)
-                            found_override = True
-                            break
-
-                    if not found_override:
-                        style_str = format_traits(style_traits, "#663300") # Apply brown
-                        default_text = "How {} is the caption's style?"
-                        default_options = ["Not at all", "Weak", "Moderate", "Strong", "Very Strong"]
-                        if style_q_template_obj:
-                            default_text = style_q_template_obj.get('default_text', default_text)
-                            default_options = style_q_template_obj.get('default_options', default_options)
-                        style_q_text_final = default_text.format(style_str)
-                        style_q_options_final = default_options
-                        terms_to_define.update(style_traits)
-
-                    options_map['part3_style_relevance'] = style_q_options_final # Update the options map
+                    submission_id = get_submission_id(view_state_key)
+                    plan = all_data['plans']['part3'][comparison_id] # Question HTML, options and terms, compiled at load time
+                    questions_to_ask = plan['questions']
+
+                    @st.fragment
+                    @traced_fragment("part3:fragment")
+                    def render_p3_rating_panel():
+                        """Part 3's sliders and submit button, rerun on their own like Part 1's."""
+                        validation_placeholder.empty() # A full rerun used to clear the warning
+                        interacted_state = st.session_state.get(view_state_key, {}).get('interacted', {})
+                        question_cols = st.columns(3) # 3 columns
+
+                        # Copied from Part 1: render_slider function
+                        def render_p3_slider(q, col, q_index, view_key_arg):
+                            with col:
+                                slider_key = f"p3_ss_{q['id']}_{comparison_id}" # Unique key for part 3
+                                st.markdown(q['label_html'], unsafe_allow_html=True)
+                                st.select_slider(
+                                    q['id'], 
+                                    options=q['options'], 
+                                    key=slider_key, 
+                                    label_visibility="collapsed", 
+                                    on_change=mark_p3_interacted, # Use the new p3_interacted
+                                    args=(q['id'], view_key_arg, q_index), 
+                                    value=q['options'][0]
+                                )
+
+                        num_interacted = sum(1 for flag in interacted_state.values() if flag)
+                        questions_to_show = num_interacted + 1
+
+                        if questions_to_show >= 1: render_p3_slider(questions_to_ask[0], question_cols[0], 0, view_state_key)
+                        if questions_to_show >= 2: render_p3_slider(questions_to_ask[1], question_cols[1], 1, view_state_key)
+                        if questions_to_show >= 3: render_p3_slider(questions_to_ask[2], question_cols[2], 2, view_state_key)
                     
-                    # Copied from Part 1: Get question templates
-                    tone_q_template = next((q['text'] for q in part1_q_templates if q['id'] == 'tone_relevance'), "How {} does the caption sound?")
-                    fact_q_template = next((q['text'] for q in part1_q_templates if q['id'] == 'factual_consistency'), "How factually accurate is the caption (refer to video and summary)?")
-
-                    questions_to_ask = [
-                        {"id": "part3_tone_relevance", "text": tone_q_template.format(tone_str)},
-                        {"id": "part3_style_relevance", "text": style_q_text_final},
-                        {"id": "part3_factual_consistency", "text": fact_q_template}
-                    ]
-
-                    interacted_state = st.session_state.get(view_state_key, {}).get('interacted', {})
-                    question_cols = st.columns(3) # 3 columns
-
-                    # Copied from Part 1: render_slider function
-                    def render_p3_slider(q, col, q_index, view_key_arg):
-                        with col:
-                            slider_key = f"p3_ss_{q['id']}_{comparison_id}" # Unique key for part 3
-                            
-                            super_label = ""
-                            if q['id'] == "part3_tone_relevance":
-                                super_label = "<div class='question-super-label' style='color: #000099;'>Tone</div>"
-                            elif q['id'] == "part3_style_relevance":
-                                super_label = "<div class='question-super-label' style='color: #663300;'>Style</div>"
-                            else:
-                                super_label = "<div class='question-super-label'>&nbsp;</div>" 
-                            
-                            question_text = f"<strong>{q_index + 1}. {q['text']}</strong>"
-                            
-                            st.markdown(f"<div class='slider-label'>{super_label}<div class='slider-question-text'>{question_text}</div></div>", unsafe_allow_html=True)
-                            
-                            st.select_slider(
-                                q['id'], 
-                                options=options_map[q['id']], 
-                                key=slider_key, 
-                                label_visibility="collapsed", 
-                                on_change=mark_p3_interacted, # Use the new p3_interacted
-                                args=(q['id'], view_key_arg, q_index), 
-                                value=options_map[q['id']][0]
-                            )
-
-                    num_interacted = sum(1 for flag in interacted_state.values() if flag)
-                    questions_to_show = num_interacted + 1
-
-                    if questions_to_show >= 1: render_p3_slider(questions_to_ask[0], question_cols[0], 0, view_state_key)
-                    if questions_to_show >= 2: render_p3_slider(questions_to_ask[1], question_cols[1], 1, view_state_key)
-                    if questions_to_show >= 3: render_p3_slider(questions_to_ask[2], question_cols[2], 2, view_state_key)
-                    
-                    if questions_to_show > len(questions_to_ask):
-                        if st.button("Submit Ratings", key=f"submit_comp_p3_{comparison_id}"): # Re-using button text from Part 1
-                            all_interacted = all(interacted_state.get(qid, False) for qid in question_ids)
-                            if not all_interacted:
-                                missing_qs = [i+1 for i, qid in enumerate(question_ids) if not interacted_state.get(qid, False)]
-                                validation_placeholder.warning(f"⚠️ Please move the slider for question(s): {', '.join(map(str, missing_qs))}")
-                            else:
-                                with st.spinner("Saving response..."):
-                                    all_saved = True
-                                    responses_to_save = {qid: st.session_state.get(f"p3_ss_{qid}_{comparison_id}") for qid in question_ids}
-                                    for q_id, choice_text in responses_to_save.items():
-                                        full_q_text = next((q['text'] for q in questions_to_ask if q['id'] == q_id), "N.A.")
-                                        
-                                        if not save_response(st.session_state.email, st.session_state.age, st.session_state.gender, current_comp, current_comp, choice_text, 'user_study_part3', full_q_text):
-                                            all_saved = False
-                                            break
-                                if all_saved:
-                                    st.session_state.current_comparison_index += 1
-                                    st.session_state.pop(view_state_key, None)
-                                    st.rerun()
+                        if questions_to_show > len(questions_to_ask):
+                            if st.button("Submit Ratings", key=f"submit_comp_p3_{comparison_id}"): # Re-using button text from Part 1
+                                all_interacted = all(interacted_state.get(qid, False) for qid in question_ids)
+                                if not all_interacted:
+                                    missing_qs = [i+1 for i, qid in enumerate(question_ids) if not interacted_state.get(qid, False)]
+                                    validation_placeholder.warning(f"⚠️ Please move the slider for question(s): {', '.join(map(str, missing_qs))}")
+                                else:
+                                    with st.spinner("Saving response..."):
+                                        responses_to_save = {qid: st.session_state.get(f"p3_ss_{qid}_{comparison_id}") for qid in question_ids}
+                                        answers = [(q_id, next((q['text'] for q in questions_to_ask if q['id'] == q_id), "N.A."), choice_text) for q_id, choice_text in responses_to_save.items()]
+                                        all_saved = save_responses(st.session_state.email, st.session_state.age, st.session_state.gender, current_comp, current_comp, answers, StudyPhase.PART3, submission_id=submission_id)
+                                    if all_saved:
+                                        st.session_state.current_comparison_index += 1
+                                        st.session_state.pop(view_state_key, None)
+                                        st.rerun()
+                    render_p3_rating_panel()
                 # --- END MODIFIED ---
 
-                    # Use definitions from session state
-                    reference_html = '<div class="reference-box"><h3>Reference</h3><ul>' + "".join(f"<li><strong>{term}:</strong> {ALL_DEFINITIONS.get(term, 'Definition not found.')}</li>" for term in sorted(list(terms_to_define)) if ALL_DEFINITIONS.get(term)) + "</ul></div>"
-                    st.markdown(reference_html, unsafe_allow_html=True)
+                    st.markdown(plan['reference_html'], unsafe_allow_html=True) # Precomputed at load time
 
     # --- ###################################################### ---
     # --- ############## END: MAJOR CHANGE TO PART 3 ############# ---
@@ -1617,7 +1636,33 @@ elif st.session_state.page == 'final_thank_you':
     st.title("Study Complete! Thank You!")
     st.success("You have successfully completed all parts of the study. We sincerely appreciate your time and valuable contribution to our research!")
 
+elif st.session_state.page == 'admin':
+    st.title("Live Rating Summary")
+    if all_data['media_problems']:
+        st.warning(f"{len(all_data['media_problems'])} media file(s) do not match media_index.json; run `python media_index.py build`.")
+        st.dataframe(pd.DataFrame(sorted(all_data['media_problems'].items()), columns=["file", "problem"]), hide_index=True)
+    get_response_writer() # Make sure this process is replaying (and aggregating) responses
+    aggregates = get_aggregate_index()
+    summary_rows = aggregates.snapshot()
+    if not summary_rows:
+        st.info("No ratings have been stored yet.")
+    else:
+        summary_df = pd.DataFrame(summary_rows)
+        summary_df['std'] = summary_df['variance'] ** 0.5
+        sample_col, question_col = st.columns(2)
+        with sample_col:
+            selected_sample = st.selectbox("Caption / comparison", sorted(summary_df['sample_id'].unique()))
+        with question_col:
+            selected_question = st.selectbox("Question", sorted(summary_df.loc[summary_df['sample_id'] == selected_sample, 'question_id']))
+        stats = aggregates.get(selected_sample, selected_question)
+        count_col, mean_col, std_col = st.columns(3)
+        count_col.metric("Ratings", stats['count'])
+        mean_col.metric("Mean", f"{stats['mean']:.2f}")
+        std_col.metric("Std. dev.", f"{stats['variance'] ** 0.5:.2f}")
+        st.dataframe(summary_df, hide_index=True, width="stretch")
+
 # --- JavaScript ---
+trace.lap("keyboard_js")
 # --- JavaScript ---
 js_script = """
 const parent_document = window.parent.document;
@@ -1683,4 +1728,5 @@ setInterval(function() {
 
 """
 # Make sure to update the key so Streamlit registers the change
-streamlit_js_eval(js_expressions=js_script, key="keyboard_listener_v5")
\ No newline at end of file
+streamlit_js_eval(js_expressions=js_script, key="keyboard_listener_v5")
+trace.finish()
\ No newline at end of file